@@ -33,6 +33,10 @@ def create_app(config_class='config.Config'):
     # 初始化数据库
     db.init_app(app)
 
+    # 命令行命令（flask init-db 等）
+    from .commands import register_commands
+    register_commands(app)
+
     CORS(
         app,
         resources={
@@ -0,0 +1,21 @@
+import click
+
+from .extensions import db
+
+
+def register_commands(app):
+    """注册 flask 命令行命令"""
+
+    @app.cli.command('init-db')
+    def init_db():
+        """创建尚不存在的数据表（如提交记录表），已有的表不受影响"""
+        from . import models  # noqa: F401  确保全部模型已注册
+        db.create_all()
+        click.echo('数据表已创建')
+
+    @app.cli.command('migrate-submissions')
+    @click.option('--batch-size', default=500, show_default=True, help='每批处理的用户数')
+    def migrate_submissions(batch_size):
+        """把用户 questions 字段中的做题记录迁移到提交记录表（可重复执行）"""
+        from .services.submission_service import migrate_question_records
+        click.echo(f'已迁移 {migrate_question_records(batch_size)} 条做题记录')
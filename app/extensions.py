@@ -12,6 +12,8 @@ db = SQLAlchemy()
 class RedisWrapper:
     def __init__(self, app=None):
         self.redis = None
+        # 读写二进制数据（如测试数据压缩包）的客户端，不做解码
+        self.binary = None
         if app is not None:
             self.init_app(app)
 
@@ -25,6 +27,14 @@ class RedisWrapper:
                 decode_responses=True
             )
         )
+        self.binary = redis.Redis(
+            connection_pool=redis.ConnectionPool(
+                host=app.config['REDIS_CONFIG']['host'],
+                port=app.config['REDIS_CONFIG']['port'],
+                db=app.config['REDIS_CONFIG']['db'],
+                max_connections=10
+            )
+        )
 
     def __getattr__(self, name):
         return getattr(self.redis, name)
@@ -42,5 +52,15 @@ celery = Celery(
 )
 celery.conf.update(
     beat_schedule_filename=os.path.join(Config.beat_schedule_dir, 'celerybeat-schedule'),
-    imports=['app.utils.race_task'],
+    imports=['app.utils.race_task', 'app.utils.judge_task'],
+    # 判题任务走独立队列，由专门的判题 worker 消费
+    task_routes={'judge.*': {'queue': Config.JUDGE_QUEUE}},
+    task_track_started=True,
+    # 判题队列按优先级（0~9，0 最先取出）区分通道，每个优先级对应 Redis 中的一个列表
+    broker_transport_options={'priority_steps': list(range(10))},
+    task_default_priority=Config.JUDGE_PRIORITY_LANES['practice'],
+    # 每次只预取一个任务，新到达的高优先级提交不会排在已预取的低优先级任务之后
+    worker_prefetch_multiplier=1,
+    # 每个 worker 另外消费自己的专属队列（<worker 名>.dq2），用于向每个判题节点分别发送预热任务
+    worker_direct=True,
 )
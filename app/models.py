@@ -11,7 +11,8 @@ class User(db.Model):
     email = db.Column(db.String(120), nullable=False)
     description = db.Column(db.Text, nullable=False, default='热爱编程，喜欢解决复杂问题。正在学习算法和数据结构')
     role = db.Column(db.Enum('user', 'admin', 'superAdmin'), nullable=False, default='user')
-    questions = db.Column(db.JSON, nullable=True)
+    # 旧的做题记录，已由提交记录表（submission_data）取代，只在迁移时读取
+    questions = db.deferred(db.Column(db.JSON, nullable=True))
     race = db.Column(db.JSON, nullable=True)
     rating = db.Column(db.Integer, nullable=True, default=1500, comment='用户等级积分')
     create_time = db.Column(db.DateTime, default=datetime.now)
@@ -79,3 +80,27 @@ class UserHeatmap(db.Model):
     user_id = db.Column(db.Integer, primary_key=True, nullable=False)
     activity_date = db.Column(db.DateTime, primary_key=True)
     activity_score = db.Column(db.Integer, nullable=False)
+
+
+class Submission(db.Model):
+    """提交记录（只追加），个人主页、做题记录、重测和题目状态重算都从这里读取"""
+    __tablename__ = 'submission_data'
+    __table_args__ = (
+        db.Index('ix_submission_user_time', 'user_id', 'created_at'),
+        db.Index('ix_submission_user_question', 'user_id', 'question_id'),
+        db.Index('ix_submission_question_race', 'question_id', 'race_id', 'created_at'),
+    )
+
+    uid = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.Integer, nullable=False, comment='用户uid')
+    question_id = db.Column(db.Integer, nullable=False, comment='题目uid')
+    race_id = db.Column(db.Integer, nullable=False, default=0, index=True, comment='比赛uid，0表示题库')
+    language = db.Column(db.String(16), nullable=True, comment='编程语言（AI 评判和迁移的记录为空）')
+    code = db.Column(db.Text, nullable=True, comment='源码（AI 评判和迁移的记录为空）')
+    source_hash = db.Column(db.String(64), nullable=True, comment='规范化源码的 sha256')
+    status = db.Column(db.String(32), nullable=False, comment='判题结果')
+    is_passed = db.Column(db.Boolean, nullable=False, default=False, comment='是否通过')
+    score = db.Column(db.Float, nullable=True, comment='oi 模式得分')
+    time_used = db.Column(db.Float, nullable=True, comment='各测试点中最长的运行时间（毫秒）')
+    memory_used = db.Column(db.Float, nullable=True, comment='各测试点中最大的内存占用（MB）')
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now, comment='提交时间')
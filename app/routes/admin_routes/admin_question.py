@@ -1,3 +1,4 @@
+import math
 import os
 import shutil
 
@@ -5,8 +6,9 @@ from flask import current_app, request
 from werkzeug.datastructures import FileStorage
 from flask_restx import Resource, fields, reqparse
 from app import api, db
-from app.services.question_service import admin_get_questions
-from app.services.testcase_service import process_test_cases, move_test_cases
+from app.services.question_service import admin_get_questions, invalidate_judge_question
+from app.services.testcase_service import process_test_cases, move_test_cases, write_manifest, install_checker, \
+    remove_checker, publish_testdata
 from app.utils.file_utils import save_uploaded_file, extract_zip_file
 from app.utils.role_utils import role_required
 from app.models import QuestionsData, UserQuestionStatus
@@ -18,6 +20,22 @@ admin_questions_ns = api.namespace('Admin-Questions', description='题目管理
 # 题目难度枚举
 TOPIC_ENUM = ['入门', '普及', '提高', '省选', 'NOI', 'CTSC']
 
+# 判题模式：acm 遇到第一个未通过的测试点即停止；oi 运行全部测试点并按权重计分
+JUDGE_MODE_ENUM = ['acm', 'oi']
+
+
+def validate_case_weights(case_weights):
+    """
+    验证测试点权重：{测试点ID: 非负数}
+    :return: 错误信息，合法时返回 None
+    """
+    if not isinstance(case_weights, dict):
+        return '测试点权重必须是 {测试点ID: 权重} 格式的对象'
+    for case_id, weight in case_weights.items():
+        if isinstance(weight, bool) or not isinstance(weight, (int, float)) or not math.isfinite(weight) or weight < 0:
+            return f'测试点 {case_id} 的权重必须是非负数'
+    return None
+
 # 示例模型
 example_model = admin_questions_ns.model('Example', {
     'input': fields.String,
@@ -36,7 +54,9 @@ create_question_model = admin_questions_ns.model('CreateQuestion', {
         'input_format': fields.String(example='两个整数，空格分隔'),
         'output_format': fields.String(example='一个整数'),
         'constraints': fields.List(fields.String, example=['-1000 ≤ a, b ≤ 1000']),
-        'examples': fields.List(fields.Nested(example_model))
+        'examples': fields.List(fields.Nested(example_model)),
+        'judge_mode': fields.String(enum=JUDGE_MODE_ENUM, example='acm', description='判题模式，默认 acm'),
+        'case_weights': fields.Raw(example={'1': 2}, description='oi 模式下各测试点的权重，未设置的测试点权重为 1')
     })),
     'topic': fields.String(required=True, enum=TOPIC_ENUM, example='入门'),
     'submit_num': fields.Integer(example=0, description='总提交次数'),
@@ -61,7 +81,9 @@ update_question_model = admin_questions_ns.model('UpdateQuestion', {
         'input_format': fields.String,
         'output_format': fields.String,
         'constraints': fields.List(fields.String),
-        'examples': fields.List(fields.Nested(example_model))
+        'examples': fields.List(fields.Nested(example_model)),
+        'judge_mode': fields.String(enum=JUDGE_MODE_ENUM),
+        'case_weights': fields.Raw
     })),
     'topic': fields.String(enum=TOPIC_ENUM)
 })
@@ -168,6 +190,16 @@ class AdminQuestionList(Resource):
                 "message": f'难度必须是以下之一: {", ".join(TOPIC_ENUM)}'
             }
 
+        if data['question'].get('judge_mode', 'acm') not in JUDGE_MODE_ENUM:
+            return {
+                "success": False,
+                "message": f'判题模式必须是以下之一: {", ".join(JUDGE_MODE_ENUM)}'
+            }, 400
+
+        weights_error = validate_case_weights(data['question'].get('case_weights') or {})
+        if weights_error:
+            return {"success": False, "message": weights_error}, 400
+
         new_question = QuestionsData(
             question={
                 'title': data['question']['title'],
@@ -177,7 +209,9 @@ class AdminQuestionList(Resource):
                 'input_format': data['question'].get('input_format', ''),
                 'output_format': data['question'].get('output_format', ''),
                 'constraints': data['question'].get('constraints', []),
-                'examples': data['question'].get('examples', [])
+                'examples': data['question'].get('examples', []),
+                'judge_mode': data['question'].get('judge_mode', 'acm'),
+                'case_weights': data['question'].get('case_weights') or {}
             },
             topic=data['topic'],
             is_contest_question=data.get('is_contest_question', 0),
@@ -204,6 +238,7 @@ class AdminQuestionDetail(Resource):
 
         db.session.delete(question)
         db.session.commit()
+        invalidate_judge_question(question_id)
         return {'success': True, 'message': '删除成功'}, 200
 
     @admin_questions_ns.expect(update_question_model)
@@ -230,8 +265,18 @@ class AdminQuestionDetail(Resource):
                 'input_format': data['question'].get('input_format', current.get('input_format', '')),
                 'output_format': data['question'].get('output_format', current.get('output_format', '')),
                 'constraints': data['question'].get('constraints', current.get('constraints', [])),
-                'examples': data['question'].get('examples', current.get('examples', []))
+                'examples': data['question'].get('examples', current.get('examples', [])),
+                'judge_mode': data['question'].get('judge_mode', current.get('judge_mode', 'acm')),
+                'case_weights': data['question'].get('case_weights', current.get('case_weights', {}))
             }
+            if update_data['question']['judge_mode'] not in JUDGE_MODE_ENUM:
+                return {
+                    "success": False,
+                    "message": f'判题模式必须是以下之一: {", ".join(JUDGE_MODE_ENUM)}'
+                }, 400
+            weights_error = validate_case_weights(update_data['question']['case_weights'] or {})
+            if weights_error:
+                return {"success": False, "message": weights_error}, 400
 
         if 'topic' in data:
             if data['topic'] not in TOPIC_ENUM:
@@ -246,6 +291,7 @@ class AdminQuestionDetail(Resource):
             setattr(question, key, value)
 
         db.session.commit()
+        invalidate_judge_question(question_id)
         return {'success': True, 'message': '更新成功'}, 200
 
     @admin_questions_ns.marshal_with(create_question_model)
@@ -308,6 +354,9 @@ class TestCaseUploadQuestion(Resource):
                 # 正确的目标路径
                 target_dir = os.path.join(Config.TESTCASE_UPLOAD_DIR, '../problems', f"testcases_{question_id}")
                 move_test_cases(extract_dir, target_dir)
+                # 生成测试用例清单，判题时直接读取；按版本发布到 Redis，供其他判题节点拉取
+                manifest = write_manifest(target_dir)
+                publish_testdata(question_id, manifest)
 
                 # 清理临时文件
                 shutil.rmtree(extract_dir)
@@ -325,6 +374,7 @@ class TestCaseUploadQuestion(Resource):
                 "details": {
                     "question_id": question_id,
                     "test_cases_count": result['count'],
+                    "testcase_version": manifest['version'],
                     "processed_files": extracted_files
                 }
             }
@@ -336,3 +386,80 @@ class TestCaseUploadQuestion(Resource):
                 "message": "测试用例上传处理失败",
                 "error": str(e)
             }, 500
+
+
+# 特殊判题程序上传解析器
+checker_upload_parser = reqparse.RequestParser()
+checker_upload_parser.add_argument(
+    'file',
+    type=FileStorage,
+    location='files',
+    required=True,
+    help='特殊判题程序（checker）的 C++ 源码'
+)
+
+
+@admin_questions_ns.route('/checker-upload/<int:question_id>')
+class CheckerUploadQuestion(Resource):
+    @admin_questions_ns.expect(checker_upload_parser)
+    @admin_questions_ns.response(400, '参数验证失败')
+    @admin_questions_ns.response(404, '题目不存在')
+    @role_required('admin', 'superAdmin')
+    def post(self, question_id):
+        """上传特殊判题程序（上传时编译，编译失败不生效）"""
+        if not QuestionsData.query.get(question_id):
+            return {'success': False, 'message': '题目不存在'}, 404
+
+        args = checker_upload_parser.parse_args()
+        try:
+            code = args['file'].read().decode('utf-8')
+        except UnicodeDecodeError:
+            return {"success": False, "message": "源码必须是 UTF-8 编码"}, 400
+        if not code.strip():
+            return {"success": False, "message": "源码不能为空"}, 400
+
+        try:
+            target_dir = os.path.join(Config.TESTCASE_DIR, f"testcases_{question_id}")
+            manifest, compile_error = install_checker(target_dir, code)
+            if compile_error is not None:
+                return {
+                    "success": False,
+                    "message": "特殊判题程序编译失败",
+                    "details": compile_error
+                }, 400
+            publish_testdata(question_id, manifest)
+
+            return {
+                "success": True,
+                "message": "特殊判题程序已上传并编译",
+                "details": {
+                    "question_id": question_id,
+                    "testcase_version": manifest['version']
+                }
+            }
+        except Exception as e:
+            current_app.logger.error(f"特殊判题程序上传失败: {str(e)}", exc_info=True)
+            return {
+                "success": False,
+                "message": "特殊判题程序上传失败",
+                "error": str(e)
+            }, 500
+
+    @admin_questions_ns.response(404, '测试用例不存在')
+    @role_required('admin', 'superAdmin')
+    def delete(self, question_id):
+        """删除特殊判题程序，恢复逐行比较"""
+        target_dir = os.path.join(Config.TESTCASE_DIR, f"testcases_{question_id}")
+        if not os.path.exists(target_dir):
+            return {'success': False, 'message': '测试用例不存在'}, 404
+
+        manifest = remove_checker(target_dir)
+        publish_testdata(question_id, manifest)
+        return {
+            "success": True,
+            "message": "特殊判题程序已删除",
+            "details": {
+                "question_id": question_id,
+                "testcase_version": manifest['version']
+            }
+        }
@@ -1,17 +1,23 @@
 from flask import g
 from flask_restx import Resource, reqparse
-import os
-
-from datetime import datetime as dt
+import json
+import uuid
 
 import config
-from app import api
-from app.models import QuestionsData
-from app.services.judge_service import _judge_cpp
-from app.services.panel_service import update_user_heatmap
-from app.services.question_service import add_question_record, update_user_question_status
-from app.services.race_service import validate_race_access, update_race_rank
-from app.utils.role_utils import optional_login
+from app import api, redis_wrapper
+from app.services.judge_metrics_service import get_judge_metrics
+from app.services.judge_node_service import get_judge_nodes
+from app.services.judge_queue_service import acquire_submit_token, check_queue_capacity, judge_lane, \
+    refund_submit_token
+from app.services.judge_service import get_cached_verdict, record_judge_result, verdict_cache_key
+from app.services.question_service import get_judge_question
+from app.models import RaceData
+from app.services.race_service import validate_race_access
+from app.services.rejudge_service import create_rejudge_job, get_rejudge_progress
+from app.services.testcase_service import get_testdata_version, testdata_exists
+from app.utils.judge_task import enqueue_judge_submission, judge_submission_task, start_rejudge
+from app.utils.judge_utils import strip_timing
+from app.utils.role_utils import optional_login, role_required
 from app.utils.validators import safe_int
 
 judge_ns = api.namespace('judge', description='判题相关', path='/api/judge')
@@ -24,13 +30,32 @@ judge_parser.add_argument('language', type=str, required=True, choices=['cpp', '
 judge_parser.add_argument('problem_id', type=int, required=True, help='问题ID', location='form')
 judge_parser.add_argument('race_id', type=int, required=False, help='比赛ID（可选）', location='form')
 
+# 重测参数：题目ID和比赛ID二选一
+rejudge_parser = reqparse.RequestParser()
+rejudge_parser.add_argument('problem_id', type=int, required=False, help='重测该题目的全部提交', location='json')
+rejudge_parser.add_argument('race_id', type=int, required=False, help='重测该比赛的全部提交', location='json')
+
+# celery 任务状态 -> 对外展示的判题状态
+TASK_STATUS = {
+    'PENDING': 'Pending',
+    'RECEIVED': 'Pending',
+    'STARTED': 'Judging',
+    'RETRY': 'Judging',
+}
+
+# 可以查看判题各阶段耗时的角色
+TIMING_ROLES = ('admin', 'superAdmin')
+
+# 直接使用缓存结果的提交，其判题结果保存在 judge:result:<提交ID>
+CACHED_RESULT_KEY = 'judge:result:{}'
+
 
 @judge_ns.route('/submit')
 class JudgeSubmission(Resource):
     @judge_ns.expect(judge_parser)
     @optional_login
     def post(self):
-        """提交代码进行判题"""
+        """提交代码进行判题（进入判题队列，立即返回提交ID）"""
         args = judge_parser.parse_args()
         code = args['code']
         language = args['language']
@@ -44,38 +69,155 @@ class JudgeSubmission(Resource):
         if not all([code, language, problem_id]):
             return {"success": False, "message": "缺少必要参数"}, 400
 
+        if language != 'cpp':
+            return {"success": False, "message": "不支持的语言"}, 400
+
         if race_id > 0:
             is_valid, err_msg, err_code = validate_race_access(user_id, race_id)
             if not is_valid:
                 return {"success": False, "message": err_msg}, err_code
 
-        question = QuestionsData.query.filter_by(uid=problem_id).first()
-        time_limit = question.question.get('time_limit')
-        memory_limit = question.question.get('memory_limit') * 1024 * 1024
+        question = get_judge_question(problem_id)
+        if not question:
+            return {"success": False, "message": "题目不存在"}, 404
 
-        # 1. 准备测试用例
-        test_cases_dir = config.Config.TESTCASE_DIR + f"/testcases_{problem_id}"
-        if not os.path.exists(test_cases_dir):
+        # 测试数据可能只发布在 Redis 中，由判题节点按版本拉取，提交所在的机器不需要持有
+        if not testdata_exists(problem_id):
             return {"success": False, "message": "测试用例不存在"}, 404
 
-        # 2. 根据语言编译/准备代码
+        # 通过校验的提交才消耗令牌：每个用户按令牌桶限制提交频率
+        allowed, retry_after = acquire_submit_token(user_id)
+        if not allowed:
+            return {"success": False, "message": "提交过于频繁，请稍后再试", "retry_after": retry_after}, \
+                429, {'Retry-After': str(retry_after)}
+
+        # 相同提交（题目、测试数据版本、语言、规范化源码相同）在时间窗口内直接使用已有结果，仍然记录做题统计
+        version = get_testdata_version(problem_id)
+        if version:
+            try:
+                cached = get_cached_verdict(verdict_cache_key(problem_id, version, language, code, question))
+                if cached:
+                    record_judge_result(user_id, problem_id, cached, race_id=race_id, code=code, language=language)
+                    submission_id = uuid.uuid4().hex
+                    redis_wrapper.setex(CACHED_RESULT_KEY.format(submission_id),
+                                        config.Config.JUDGE_SUBMISSION_TTL, json.dumps(cached))
+                    redis_wrapper.setex(f"judge:submission:{submission_id}", config.Config.JUDGE_SUBMISSION_TTL, user_id)
+                    return {"success": True, "submission_id": submission_id, "cached": True}, 202
+            except Exception as e:
+                refund_submit_token(user_id)
+                return {"success": False, "message": f"提交判题失败: {str(e)}"}, 500
+
+        # 有界等待队列：前方待判任务过多时快速拒绝，避免判题机过载后所有提交一起变慢
+        has_capacity, retry_after = check_queue_capacity(judge_lane(race_id))
+        if not has_capacity:
+            refund_submit_token(user_id)
+            return {"success": False, "message": "判题队列已满，请稍后再试", "retry_after": retry_after}, \
+                503, {'Retry-After': str(retry_after)}
+
+        try:
+            task = enqueue_judge_submission(user_id, problem_id, code, language, race_id)
+            # 记录提交者，查询判题状态时校验
+            redis_wrapper.setex(f"judge:submission:{task.id}", config.Config.JUDGE_SUBMISSION_TTL, user_id)
+        except Exception as e:
+            refund_submit_token(user_id)
+            return {"success": False, "message": f"提交判题失败: {str(e)}"}, 500
+
+        return {"success": True, "submission_id": task.id}, 202
+
+
+@judge_ns.route('/status/<string:submission_id>')
+class JudgeStatus(Resource):
+    @optional_login
+    def get(self, submission_id):
+        """查询判题状态"""
+        user_id = getattr(g, 'current_user_id', None)
+        if not user_id:
+            return {"success": False, "message": "请先登录"}, 401
+
+        owner = redis_wrapper.get(f"judge:submission:{submission_id}")
+        if owner is None:
+            return {"success": False, "message": "提交记录不存在或已过期"}, 404
+        if safe_int(owner) != user_id:
+            return {"success": False, "message": "权限不足"}, 403
+
+        cached = redis_wrapper.get(CACHED_RESULT_KEY.format(submission_id))
+        if cached:
+            return {"success": True, "finished": True, "result": json.loads(cached)}
+
+        task = judge_submission_task.AsyncResult(submission_id)
+        if task.state == 'SUCCESS':
+            result = task.result
+            if getattr(g, 'current_user_role', None) not in TIMING_ROLES:
+                result = strip_timing(result)
+            return {"success": True, "finished": True, "result": result}
+        if task.state == 'FAILURE':
+            return {
+                "success": True,
+                "finished": True,
+                "result": {"status": "System Error", "message": str(task.result)}
+            }
+
+        return {
+            "success": True,
+            "finished": False,
+            "status": TASK_STATUS.get(task.state, 'Judging')
+        }
+
+
+@judge_ns.route('/metrics')
+class JudgeMetrics(Resource):
+    @role_required('admin', 'superAdmin')
+    def get(self):
+        """查看判题 worker 指标（测试数据缓存命中率、常驻内存、各阶段耗时等）"""
         try:
-            if language == 'cpp':
-                result = _judge_cpp(code, test_cases_dir, time_limit, memory_limit)
+            return {"success": True, **get_judge_metrics()}
+        except Exception as e:
+            return {"success": False, "message": f"获取判题指标失败: {str(e)}"}, 500
 
-                is_passed = False
-                if result['status'] == 'Accepted':
-                    is_passed = True
-                    update_user_heatmap(user_id, dt.now().strftime("%Y-%m-%d"))
 
-                add_question_record(user_id, problem_id, is_passed)
-                update_user_question_status(user_id, problem_id, is_passed, race_id=race_id)
-                if race_id and race_id > 0:
-                    update_race_rank(user_id, problem_id, is_passed, race_id)
+@judge_ns.route('/nodes')
+class JudgeNodes(Resource):
+    @role_required('admin', 'superAdmin')
+    def get(self):
+        """查看在线的判题节点及其容量（并发数、正在判题数、负载）"""
+        try:
+            return {"success": True, **get_judge_nodes()}
+        except Exception as e:
+            return {"success": False, "message": f"获取判题节点失败: {str(e)}"}, 500
 
-            else:
-                return {"success": False, "message": "不支持的语言"}, 400
+
+@judge_ns.route('/rejudge')
+class Rejudge(Resource):
+    @judge_ns.expect(rejudge_parser)
+    @role_required('admin', 'superAdmin')
+    def post(self):
+        """重测某道题或某场比赛的全部提交（低优先级并行判题，结束后批量重算题目状态和排行榜）"""
+        args = rejudge_parser.parse_args()
+        problem_id = args.get('problem_id')
+        race_id = args.get('race_id')
+        if (problem_id is None) == (race_id is None):
+            return {"success": False, "message": "题目ID和比赛ID需指定且只能指定一个"}, 400
+
+        if problem_id is not None and not get_judge_question(problem_id):
+            return {"success": False, "message": "题目不存在"}, 404
+        if race_id is not None and not RaceData.query.get(race_id):
+            return {"success": False, "message": "比赛不存在"}, 404
+
+        try:
+            job_id = create_rejudge_job(question_id=problem_id, race_id=race_id)
+            start_rejudge(job_id)
         except Exception as e:
-            return {"success": False, "message": f"判题过程中出错: {str(e)}"}, 500
+            return {"success": False, "message": f"创建重测任务失败: {str(e)}"}, 500
+
+        return {"success": True, "job_id": job_id}, 202
+
 
-        return {"success": True, "result": result}
+@judge_ns.route('/rejudge/<string:job_id>')
+class RejudgeProgress(Resource):
+    @role_required('admin', 'superAdmin')
+    def get(self, job_id):
+        """查询重测进度"""
+        progress = get_rejudge_progress(job_id)
+        if progress is None:
+            return {"success": False, "message": "重测任务不存在或已过期"}, 404
+        return {"success": True, "progress": progress}
@@ -0,0 +1,280 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from functools import lru_cache
+
+from config import Config
+
+CPP_COMPILER = 'g++'
+CPP_FLAGS = ['-O2', '-std=c++11']
+
+EXE_SUFFIX = '.exe' if os.name == 'nt' else ''
+
+# 预编译头：选手代码绝大多数使用 #include <bits/stdc++.h>
+PCH_HEADER = 'bits/stdc++.h'
+
+# 判题运行器源码，见 runner.cpp 中的说明
+RUNNER_SOURCE = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'utils', 'runner', 'runner.cpp')
+
+_evict_lock = threading.Lock()
+_pch_lock = threading.Lock()
+_pch_include_dirs = {}
+_runner_lock = threading.Lock()
+_runner_paths = {}
+
+
+@lru_cache(maxsize=None)
+def _compiler_version(compiler):
+    """获取编译器版本（每个进程只查询一次）"""
+    try:
+        output = subprocess.run([compiler, '--version'], stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE).stdout.decode('utf-8', errors='replace')
+        return output.splitlines()[0] if output else ''
+    except OSError:
+        return ''
+
+
+def _cache_key(code, compiler, flags):
+    """编译缓存键：源码 + 编译选项 + 编译器版本"""
+    digest = hashlib.sha256()
+    for part in (compiler, _compiler_version(compiler), ' '.join(flags), code):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def _touch(path):
+    """更新修改时间，用于 LRU 淘汰"""
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+
+def _evict(cache_dir, max_bytes):
+    """缓存超过容量上限时，按最近使用时间淘汰最旧的文件"""
+    with _evict_lock:
+        entries = []
+        total = 0
+        for name in os.listdir(cache_dir):
+            path = os.path.join(cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if not os.path.isfile(path):
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        if total <= max_bytes:
+            return
+
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                continue
+            if total <= max_bytes:
+                break
+
+
+def _pch_key(compiler, flags):
+    digest = hashlib.sha256()
+    for part in (compiler, _compiler_version(compiler), ' '.join(flags)):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()[:16]
+
+
+def _build_pch(compiler, flags, include_dir):
+    """为当前编译器和编译选项构建 bits/stdc++.h 的预编译头"""
+    gch_file = os.path.join(include_dir, PCH_HEADER + '.gch')
+    if os.path.exists(gch_file):
+        return True
+
+    os.makedirs(os.path.dirname(gch_file), exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix='build_', dir=include_dir)
+    try:
+        header_file = os.path.join(work_dir, 'stdcpp.h')
+        output_file = os.path.join(work_dir, 'stdcpp.h.gch')
+        with open(header_file, 'w', encoding='utf-8') as f:
+            f.write(f"#include <{PCH_HEADER}>\n")
+
+        build_result = subprocess.run(
+            [compiler, "-x", "c++-header", header_file, "-o", output_file] + flags,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            cwd=work_dir
+        )
+        if build_result.returncode != 0 or not os.path.exists(output_file):
+            return False
+
+        os.replace(output_file, gch_file)
+        return True
+    except OSError:
+        return False
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def get_pch_include_dir(compiler=CPP_COMPILER, flags=None):
+    """
+    获取预编译头所在的 include 目录（按编译器版本和编译选项区分，每种组合只构建一次）
+    :return: include 目录；未启用、正在构建或构建失败时返回 None
+    """
+    if not Config.JUDGE_USE_PCH:
+        return None
+
+    flags = CPP_FLAGS if flags is None else flags
+    key = _pch_key(compiler, flags)
+    if key in _pch_include_dirs:
+        return _pch_include_dirs[key]
+
+    # 其他线程正在构建时不等待，本次直接不使用预编译头
+    if not _pch_lock.acquire(blocking=False):
+        return None
+    try:
+        if key not in _pch_include_dirs:
+            include_dir = os.path.join(Config.PCH_DIR, key)
+            _pch_include_dirs[key] = include_dir if _build_pch(compiler, flags, include_dir) else None
+        return _pch_include_dirs[key]
+    finally:
+        _pch_lock.release()
+
+
+def _invalidate_pch(include_dir):
+    """预编译头失效（如系统头文件被更新），删除后下次编译时重新构建"""
+    with _pch_lock:
+        for key, value in list(_pch_include_dirs.items()):
+            if value == include_dir:
+                del _pch_include_dirs[key]
+        try:
+            os.remove(os.path.join(include_dir, PCH_HEADER + '.gch'))
+        except OSError:
+            pass
+
+
+def _pch_stale(stderr):
+    """
+    编译输出中是否有预编译头本身不可用的警告（文件损坏、由其他版本的编译器生成等）
+    源码在 #include 之前定义宏（如 #define int long long、_GLIBCXX_DEBUG）时 g++ 警告 "not used because ..."，
+    只是这一次编译不使用预编译头，预编译头本身仍然有效
+    """
+    for line in stderr.splitlines():
+        if b'[-Winvalid-pch]' in line and b'not used because' not in line:
+            return True
+    return False
+
+
+def compile_cpp(code):
+    """
+    编译 C++ 代码，相同源码和编译环境的结果直接复用缓存
+    :return: (可执行文件路径, 编译错误信息)，编译成功时错误信息为 None
+    """
+    cache_dir = Config.COMPILE_CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+
+    key = _cache_key(code, CPP_COMPILER, CPP_FLAGS)
+    executable = os.path.join(cache_dir, key + EXE_SUFFIX)
+    error_file = os.path.join(cache_dir, key + '.err')
+
+    # 1. 命中缓存
+    if os.path.exists(executable):
+        _touch(executable)
+        return executable, None
+    if os.path.exists(error_file):
+        _touch(error_file)
+        with open(error_file, 'r', encoding='utf-8') as f:
+            return None, f.read()
+
+    # 2. 在缓存目录下的独立临时目录中编译（同一文件系统），完成后原子地放入缓存
+    work_dir = tempfile.mkdtemp(prefix='build_', dir=cache_dir)
+    try:
+        source_file = os.path.join(work_dir, 'main.cpp')
+        output_file = os.path.join(work_dir, 'main' + EXE_SUFFIX)
+        with open(source_file, 'w', encoding='utf-8') as f:
+            f.write(code)
+
+        # 预编译头不可用时 g++ 会自动回退到系统头文件，-Winvalid-pch 用于发现失效的预编译头（见 _pch_stale）
+        command = [CPP_COMPILER, source_file, "-o", output_file] + CPP_FLAGS
+        pch_include_dir = get_pch_include_dir()
+        if pch_include_dir:
+            command += ["-I", pch_include_dir, "-Winvalid-pch"]
+
+        compile_result = subprocess.run(
+            command,
+            stderr=subprocess.PIPE,
+            cwd=work_dir
+        )
+
+        if pch_include_dir and _pch_stale(compile_result.stderr):
+            _invalidate_pch(pch_include_dir)
+
+        if compile_result.returncode != 0:
+            # 去掉临时目录前缀，保证缓存的错误信息与路径无关
+            message = compile_result.stderr.decode('utf-8', errors='replace').replace(work_dir + os.sep, '')
+            tmp_error_file = os.path.join(work_dir, 'error.txt')
+            with open(tmp_error_file, 'w', encoding='utf-8') as f:
+                f.write(message)
+            os.replace(tmp_error_file, error_file)
+            return None, message
+
+        if not os.path.exists(output_file):
+            return None, None
+
+        try:
+            os.replace(output_file, executable)
+        except OSError:
+            # 其他进程已写入同一缓存文件（Windows 下文件可能正在被执行）
+            if not os.path.exists(executable):
+                raise
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        _evict(cache_dir, Config.COMPILE_CACHE_MAX_BYTES)
+
+    return executable, None
+
+
+def get_runner_path():
+    """
+    获取判题运行器的可执行文件路径（按源码和编译器版本区分，首次调用时编译）
+    :return: 可执行文件路径；Windows 下或编译失败时返回 None
+    """
+    if os.name == 'nt':
+        return None
+
+    with _runner_lock:
+        if 'runner' in _runner_paths:
+            return _runner_paths['runner']
+
+        with open(RUNNER_SOURCE, 'r', encoding='utf-8') as f:
+            code = f.read()
+
+        runner_dir = os.path.join(Config.RUNNER_DIR, _cache_key(code, CPP_COMPILER, ['-O2']))
+        runner_path = os.path.join(runner_dir, 'runner')
+        if not os.path.exists(runner_path):
+            os.makedirs(runner_dir, exist_ok=True)
+            work_dir = tempfile.mkdtemp(prefix='build_', dir=runner_dir)
+            try:
+                source_file = os.path.join(work_dir, 'runner.cpp')
+                output_file = os.path.join(work_dir, 'runner')
+                with open(source_file, 'w', encoding='utf-8') as f:
+                    f.write(code)
+
+                build_result = subprocess.run(
+                    [CPP_COMPILER, source_file, "-o", output_file, "-O2"],
+                    stderr=subprocess.PIPE,
+                    cwd=work_dir
+                )
+                if build_result.returncode == 0 and os.path.exists(output_file):
+                    os.replace(output_file, runner_path)
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+        _runner_paths['runner'] = runner_path if os.path.exists(runner_path) else None
+        return _runner_paths['runner']
@@ -0,0 +1,151 @@
+import json
+import math
+import os
+import socket
+import threading
+import time
+from collections import deque
+
+import psutil
+
+from config import Config
+from .. import redis_wrapper
+from .testcase_service import get_case_cache_stats
+
+# 每个判题 worker 进程的指标保存在 judge:metrics:<主机名>:<进程号>
+METRICS_KEY_PREFIX = 'judge:metrics:'
+
+# 提交级别的阶段（结果 timing 中的字段）和测试点级别的阶段（details[].timing 中的字段）
+SUBMISSION_PHASES = {'queue_wait': 'queue_wait_ms', 'slot_wait': 'slot_wait_ms', 'compile': 'compile_ms',
+                     'run': 'run_ms', 'judge': 'judge_ms', 'total': 'total_ms'}
+CASE_PHASES = {'case_spawn': 'spawn_ms', 'case_run': 'run_ms', 'case_compare': 'compare_ms'}
+
+# 每个阶段的累计次数、总和、最大值（binary_size 单位为字节，其余为毫秒），以及最近 JUDGE_TIMING_SAMPLES 个样本（用于计算分位数）
+_timing_lock = threading.Lock()
+_timing_stats = {}
+
+
+def _worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _record(phase, value):
+    stats = _timing_stats.get(phase)
+    if stats is None:
+        stats = _timing_stats[phase] = {'count': 0, 'sum': 0.0, 'max': 0.0,
+                                        'samples': deque(maxlen=Config.JUDGE_TIMING_SAMPLES)}
+    stats['count'] += 1
+    stats['sum'] += value
+    stats['max'] = max(stats['max'], value)
+    stats['samples'].append(round(value, 3))
+
+
+def record_judge_timing(result):
+    """
+    把一次判题结果中的各阶段耗时计入当前进程的统计
+    :param result: 判题结果，包含 timing 和 details[].timing
+    """
+    timing = result.get('timing') or {}
+    with _timing_lock:
+        for phase, field in SUBMISSION_PHASES.items():
+            if timing.get(field) is not None:
+                _record(phase, timing[field])
+        # 各优先级通道的排队时间，如 queue_wait:contest
+        if timing.get('lane') and timing.get('queue_wait_ms') is not None:
+            _record(f"queue_wait:{timing['lane']}", timing['queue_wait_ms'])
+        if timing.get('binary_size'):
+            _record('binary_size', timing['binary_size'])
+        for detail in result.get('details') or []:
+            case_timing = detail.get('timing') or {}
+            for phase, field in CASE_PHASES.items():
+                if case_timing.get(field) is not None:
+                    _record(phase, case_timing[field])
+
+
+def get_timing_stats():
+    """当前进程的各阶段耗时统计（可 JSON 序列化）"""
+    with _timing_lock:
+        return {phase: {**stats, 'samples': list(stats['samples'])} for phase, stats in _timing_stats.items()}
+
+
+def _percentile(values, p):
+    """第 p 百分位数（最近秩法）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def _summarize_timing(workers):
+    """合并各 worker 的阶段耗时：次数、平均值、最大值，以及按最近样本计算的 p50/p99"""
+    merged = {}
+    for worker in workers:
+        for phase, stats in worker.get('timing', {}).items():
+            total = merged.setdefault(phase, {'count': 0, 'sum': 0.0, 'max': 0.0, 'samples': []})
+            total['count'] += stats['count']
+            total['sum'] += stats['sum']
+            total['max'] = max(total['max'], stats['max'])
+            total['samples'].extend(stats['samples'])
+
+    return {
+        phase: {
+            'count': stats['count'],
+            'avg': stats['sum'] / stats['count'] if stats['count'] else 0.0,
+            'p50': _percentile(stats['samples'], 50),
+            'p99': _percentile(stats['samples'], 99),
+            'max': stats['max']
+        }
+        for phase, stats in merged.items()
+    }
+
+
+def get_worker_rss():
+    """当前 worker 进程及其子进程（常驻运行器、正在运行的编译器和选手程序）的常驻内存之和，字节"""
+    process = psutil.Process()
+    total = 0
+    for p in [process] + process.children(recursive=True):
+        try:
+            total += p.memory_info().rss
+        except psutil.Error:
+            continue
+    return total
+
+
+def publish_worker_metrics():
+    """上报当前判题 worker 进程的指标，保留 JUDGE_METRICS_TTL 秒（worker 停止后自动过期）"""
+    metrics = {
+        'worker': _worker_name(),
+        'updated_at': int(time.time()),
+        'rss': get_worker_rss(),
+        'testcase_cache': get_case_cache_stats(),
+        'timing': get_timing_stats()
+    }
+    redis_wrapper.setex(METRICS_KEY_PREFIX + metrics['worker'], Config.JUDGE_METRICS_TTL, json.dumps(metrics))
+
+
+def get_judge_metrics():
+    """
+    汇总所有判题 worker 上报的指标
+    :return: 各 worker 的指标，汇总后的测试数据缓存命中率、常驻字节数和各阶段耗时
+    """
+    workers = []
+    for key in redis_wrapper.scan_iter(match=METRICS_KEY_PREFIX + '*'):
+        raw = redis_wrapper.get(key)
+        if raw:
+            workers.append(json.loads(raw))
+    workers.sort(key=lambda w: w['worker'])
+
+    totals = {'hits': 0, 'misses': 0, 'evictions': 0, 'resident_bytes': 0, 'entries': 0}
+    for worker in workers:
+        for field in totals:
+            totals[field] += worker['testcase_cache'].get(field, 0)
+    lookups = totals['hits'] + totals['misses']
+    totals['hit_rate'] = totals['hits'] / lookups if lookups else 0.0
+
+    timing = _summarize_timing(workers)
+    # 原始样本只用于汇总分位数，不随各 worker 的指标返回
+    for worker in workers:
+        for stats in worker.get('timing', {}).values():
+            stats.pop('samples', None)
+
+    return {'workers': workers, 'testcase_cache': totals, 'timing': timing}
@@ -0,0 +1,100 @@
+import json
+import os
+import threading
+import time
+
+import psutil
+
+from config import Config
+from .. import redis_wrapper
+
+# 每个判题节点（消费判题队列的 celery worker）的心跳保存在 judge:node:<worker 名>，超过 JUDGE_NODE_TTL 未更新即过期
+NODE_KEY_PREFIX = 'judge:node:'
+# 各判题节点正在判题的任务数：worker 名 -> 任务数
+NODE_BUSY_KEY = 'judge:node_busy'
+
+_heartbeats = {}
+_heartbeats_lock = threading.Lock()
+
+
+def send_heartbeat(node, concurrency):
+    """
+    上报判题节点的心跳：容量（并发判题数）、CPU 核数、负载和可用内存
+    :param node: celery worker 名（如 celery@judge-1）
+    :param concurrency: worker 的并发数
+    """
+    info = {
+        'node': node,
+        'concurrency': concurrency,
+        'cpu_count': os.cpu_count() or 1,
+        'load_avg': os.getloadavg()[0] if hasattr(os, 'getloadavg') else None,
+        'memory_available': psutil.virtual_memory().available,
+        'updated_at': int(time.time())
+    }
+    redis_wrapper.setex(NODE_KEY_PREFIX + node, Config.JUDGE_NODE_TTL, json.dumps(info))
+
+
+def start_heartbeat(node, concurrency):
+    """判题节点启动时开始定期上报心跳（后台线程），并清零上次运行遗留的任务数"""
+    with _heartbeats_lock:
+        if node in _heartbeats:
+            return
+        stop = threading.Event()
+        _heartbeats[node] = stop
+
+    redis_wrapper.hdel(NODE_BUSY_KEY, node)
+
+    def run():
+        while not stop.is_set():
+            try:
+                send_heartbeat(node, concurrency)
+            except Exception:
+                pass  # Redis 暂时不可用时等待下一次上报
+            stop.wait(Config.JUDGE_NODE_HEARTBEAT_INTERVAL)
+
+    threading.Thread(target=run, name=f"judge-heartbeat-{node}", daemon=True).start()
+
+
+def stop_heartbeat(node):
+    """判题节点正常退出时停止心跳并立即下线"""
+    with _heartbeats_lock:
+        stop = _heartbeats.pop(node, None)
+    if stop is None:
+        return
+    stop.set()
+    redis_wrapper.delete(NODE_KEY_PREFIX + node)
+    redis_wrapper.hdel(NODE_BUSY_KEY, node)
+
+
+def mark_node_busy(node, delta):
+    """判题任务开始（delta=1）或结束（delta=-1）时更新节点正在判题的任务数"""
+    if node:
+        redis_wrapper.hincrby(NODE_BUSY_KEY, node, delta)
+
+
+def get_judge_nodes():
+    """
+    获取在线的判题节点及其容量
+    :return: 各节点的心跳信息（附带正在判题数 busy、空闲数 free）和集群汇总
+    """
+    busy = redis_wrapper.hgetall(NODE_BUSY_KEY)
+    nodes = []
+    for key in redis_wrapper.scan_iter(match=NODE_KEY_PREFIX + '*'):
+        raw = redis_wrapper.get(key)
+        if not raw:
+            continue
+        node = json.loads(raw)
+        node['busy'] = max(0, int(busy.get(node['node'], 0)))
+        node['free'] = max(0, node['concurrency'] - node['busy'])
+        nodes.append(node)
+    nodes.sort(key=lambda n: n['node'])
+
+    return {
+        'nodes': nodes,
+        'total': {
+            'nodes': len(nodes),
+            'concurrency': sum(n['concurrency'] for n in nodes),
+            'busy': sum(n['busy'] for n in nodes),
+            'free': sum(n['free'] for n in nodes)
+        }
+    }
@@ -0,0 +1,130 @@
+import math
+import time
+
+from config import Config
+from .. import redis_wrapper
+from ..extensions import celery
+
+# 每个用户在判题队列中等待或正在判题的提交数
+PENDING_KEY = 'judge:pending:{}'
+
+# celery 的 Redis 传输支持的优先级范围，0 最先被取出
+MAX_PRIORITY = 9
+
+# 每个用户的提交令牌桶
+TOKEN_BUCKET_KEY = 'judge:rate:{}'
+
+# 令牌桶：按经过的时间补充令牌（不超过容量），有令牌时取走一个；
+# 返回 {是否允许, 下一个令牌的等待秒数}，等待时间以字符串返回以保留小数
+TOKEN_BUCKET_SCRIPT = '''
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(wait)}
+'''
+
+# 退还一个令牌（不超过容量）；桶已过期时本来就是满的，无需处理
+TOKEN_REFUND_SCRIPT = '''
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+if tokens then
+    redis.call('HSET', KEYS[1], 'tokens', tostring(math.min(tonumber(ARGV[1]), tokens + 1)))
+end
+return 1
+'''
+
+
+def judge_lane(race_id=0):
+    """提交所属的优先级通道：进行中比赛的提交走 contest，其余走 practice（重测走 rejudge）"""
+    return 'contest' if race_id and race_id > 0 else 'practice'
+
+
+def get_pending_count(user_id):
+    """用户在判题队列中尚未判完的提交数"""
+    return int(redis_wrapper.get(PENDING_KEY.format(user_id)) or 0)
+
+
+def submission_priority(user_id, lane):
+    """
+    计算提交在判题队列中的优先级（0 最高）：先按通道（比赛 > 练习 > 重测），
+    同一通道内按该用户尚未判完的提交数逐级降低，连续提交的用户不会挤占其他用户
+    :param lane: JUDGE_PRIORITY_LANES 中的通道名
+    """
+    priority = Config.JUDGE_PRIORITY_LANES[lane] + min(get_pending_count(user_id), Config.JUDGE_FAIRNESS_STEPS - 1)
+    return min(priority, MAX_PRIORITY)
+
+
+def add_pending(user_id):
+    """提交进入判题队列；计数带过期时间，worker 异常退出时不会永久降低该用户的优先级"""
+    key = PENDING_KEY.format(user_id)
+    pipe = redis_wrapper.pipeline()
+    pipe.incr(key)
+    pipe.expire(key, Config.JUDGE_PENDING_TTL)
+    pipe.execute()
+
+
+def remove_pending(user_id):
+    """提交判题结束"""
+    key = PENDING_KEY.format(user_id)
+    if redis_wrapper.decr(key) <= 0:
+        redis_wrapper.delete(key)
+
+
+def acquire_submit_token(user_id):
+    """
+    按令牌桶限制用户的提交频率：平均每秒 JUDGE_USER_RATE 次，最多连续 JUDGE_USER_BURST 次
+    :return: (是否允许, 建议的重试等待秒数)
+    """
+    if not Config.JUDGE_USER_RATE:
+        return True, 0
+    allowed, wait = redis_wrapper.eval(TOKEN_BUCKET_SCRIPT, 1, TOKEN_BUCKET_KEY.format(user_id),
+                                       Config.JUDGE_USER_RATE, Config.JUDGE_USER_BURST, time.time())
+    return bool(int(allowed)), max(1, math.ceil(float(wait)))
+
+
+def refund_submit_token(user_id):
+    """提交最终被拒绝（判题队列已满、入队失败）时退还令牌，避免过载时用户随后又被限流"""
+    if not Config.JUDGE_USER_RATE:
+        return
+    redis_wrapper.eval(TOKEN_REFUND_SCRIPT, 1, TOKEN_BUCKET_KEY.format(user_id), Config.JUDGE_USER_BURST)
+
+
+def get_queue_length(max_priority=MAX_PRIORITY):
+    """
+    判题队列中优先级不低于 max_priority（数值不大于）的待判任务数，直接读取消息代理中各优先级的列表长度
+    """
+    with celery.pool.acquire(block=True) as conn:
+        channel = conn.default_channel
+        pipe = channel.client.pipeline()
+        for priority in channel.priority_steps:
+            if priority <= max_priority:
+                pipe.llen(f"{Config.JUDGE_QUEUE}{channel.sep}{priority}" if priority else Config.JUDGE_QUEUE)
+        return sum(pipe.execute())
+
+
+def check_queue_capacity(lane):
+    """
+    有界等待队列：排在该通道提交之前（同一通道及更高优先级通道）的待判任务达到 JUDGE_MAX_QUEUE_LENGTH 时拒绝新提交，
+    练习通道的上限低于比赛通道，过载时先拒绝练习提交
+    :return: (是否接受, 建议的重试等待秒数)
+    """
+    limit = Config.JUDGE_MAX_QUEUE_LENGTH.get(lane)
+    if limit is None:
+        return True, 0
+    lowest = Config.JUDGE_PRIORITY_LANES[lane] + Config.JUDGE_FAIRNESS_STEPS - 1
+    if get_queue_length(lowest) < limit:
+        return True, 0
+    return False, Config.JUDGE_RETRY_AFTER
@@ -1,252 +1,874 @@
+import hashlib
+import json
+import math
 import os
+import select
+import signal
 import subprocess
+import sys
+import tempfile
 import threading
 import time
-import psutil
-
-
-def _get_test_cases(test_cases_dir):
-    # 获取所有测试点文件夹
-    case_dirs = [d for d in os.listdir(test_cases_dir)
-                 if os.path.isdir(os.path.join(test_cases_dir, d))]
-
-    test_cases = []
-    for case_dir in sorted(case_dirs, key=lambda x: int(x)):
-        case_path = os.path.join(test_cases_dir, case_dir)
-        input_files = [f for f in os.listdir(case_path) if f.endswith('.in')]
-
-        for input_file in input_files:
-            base_name = input_file[:-3]
-            output_file = base_name + '.out'
-
-            if os.path.exists(os.path.join(case_path, output_file)):
-                test_cases.append({
-                    'input': os.path.join(case_path, input_file),
-                    'output': os.path.join(case_path, output_file),
-                    'case_id': f"{case_dir}_{base_name}"
-                })
-
-    return test_cases
-
-
-def _compare_output(actual, expected):
-    # 简单的逐行比较，可以根据需要增强（如忽略空格、大小写等）
-    actual_lines = actual.splitlines()
-    expected_lines = expected.splitlines()
-
-    if len(actual_lines) != len(expected_lines):
-        return False
-
-    for a, e in zip(actual_lines, expected_lines):
-        if a.strip() != e.strip():
-            return False
-
-    return True
-
-
-def _run_test_case(command, input_file, output_file, time_limit, memory_limit):
-    # 读取输入和预期输出
-    with open(input_file, 'r') as f:
-        input_data = f.read()
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-    with open(output_file, 'r') as f:
-        expected_output = f.read().strip()
-
-    # 启动进程
-    start_time = time.time()
-    max_memory = 0
-    memory_monitor_running = True
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 
+import psutil
+from datetime import datetime as dt
+
+from config import Config
+from .. import db, redis_wrapper
+from .compile_service import compile_cpp, get_pch_include_dir, get_runner_path
+from .judge_metrics_service import record_judge_timing
+from .panel_service import update_user_heatmap
+from .question_service import get_judge_question, rejudge_question_status, update_user_question_status
+from .race_service import rejudge_race_rank, update_race_rank
+from .runner_pool import PooledProcess, get_runner_pool
+from .submission_service import keep_submission, save_submission, update_submission_result
+from .testcase_service import load_manifest, read_case_file, use_testdata
+from ..models import Submission
+from ..utils.judge_utils import split_lines, normalized_lines, output_digest, normalize_source, strip_timing
+
+# ru_maxrss 的单位：Linux 为 KB，macOS 为字节
+MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+# 超过 CPU 时间限制时进程收到的信号（对应的 returncode 为负的信号值）
+CPU_LIMIT_SIGNALS = {-getattr(signal, 'SIGXCPU', 24), -getattr(signal, 'SIGKILL', 9)}
+
+# 无法调整管道容量时按 POSIX 保证的最小容量处理
+MIN_PIPE_CAPACITY = 4096
+
+# 相同提交的判题结果缓存：judge:verdict:<题目、测试数据版本、语言、判题参数和规范化源码的哈希>
+VERDICT_CACHE_KEY = 'judge:verdict:{}'
+# 与判题机负载有关、重新判题可能得到不同结果的状态不缓存
+UNCACHEABLE_STATUSES = {'System Error', 'Time Limit Exceeded'}
+
+# 每个判题进程同时编译运行的提交数上限，避免突发提交时编译器和选手程序争抢 CPU、内存
+_judge_slots = threading.BoundedSemaphore(Config.JUDGE_MAX_CONCURRENT_JUDGES)
+
+
+class OutputLimitExceeded(Exception):
+    """选手程序输出超过限制"""
+
+
+class WallTimeExceeded(Exception):
+    """墙钟时间上限内选手程序的输出没有结束（程序或其 fork 出的进程仍持有 stdout）"""
+
+
+def _read_chunks(pipe, output_limit, timing=None, deadline=None):
+    """
+    逐块读取子进程输出，累计超过 output_limit 字节时抛出 OutputLimitExceeded
+    :param timing: 读到输出结尾时记录 output_end（perf_counter 时间）
+    :param deadline: 读取的截止时间（perf_counter 时间），到期仍未读到输出结尾时抛出 WallTimeExceeded；
+                     没有 select.poll（Windows）时不限制，由看门狗结束程序
+    """
+    fd = pipe.fileno()
+    poller = None
+    if deadline is not None and hasattr(select, 'poll'):
+        poller = select.poll()
+        poller.register(fd, select.POLLIN)
+    total = 0
+    while True:
+        if poller is not None:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0 or not poller.poll(math.ceil(remaining * 1000)):
+                raise WallTimeExceeded()
+        chunk = os.read(fd, 64 * 1024)
+        if not chunk:
+            if timing is not None:
+                timing['output_end'] = time.perf_counter()
+            return
+        total += len(chunk)
+        if total > output_limit:
+            raise OutputLimitExceeded()
+        yield chunk
+
+
+def _compare_output(actual_lines, expected_lines):
+    """
+    逐行比较两个行流，遇到第一处不同即停止
+    :return: 一致时返回 None，否则返回 (行号, 预期行, 实际行)，缺少的行为 None
+    """
+    line_no = 0
+    for expected in expected_lines:
+        line_no += 1
+        actual = next(actual_lines, None)
+        if actual != expected:
+            return line_no, expected, actual
+
+    actual = next(actual_lines, None)
+    if actual is not None:
+        return line_no + 1, None, actual
+    return None
+
+
+def _preview(line, limit=256):
+    """错误信息中展示的行内容（截断过长的行）"""
+    if line is None:
+        return None
+    text = line.decode('utf-8', errors='replace')
+    return text if len(text) <= limit else text[:limit] + '...'
+
+
+def _tee(chunks, spool_file):
+    """读取输出块的同时写入临时文件"""
+    for chunk in chunks:
+        spool_file.write(chunk)
+        yield chunk
+
+
+def _pipe_capacity(fd, size):
+    """尽量把管道容量调整到 size 字节，返回调整后的容量"""
+    if fcntl is None or not hasattr(fcntl, 'F_SETPIPE_SZ'):
+        return MIN_PIPE_CAPACITY
+    try:
+        return fcntl.fcntl(fd, fcntl.F_SETPIPE_SZ, max(size, MIN_PIPE_CAPACITY))
+    except OSError:
+        return fcntl.fcntl(fd, fcntl.F_GETPIPE_SZ)
+
+
+def _open_stdin(case):
+    """
+    打开作为选手程序 stdin 的文件对象
+    输入不超过管道容量时从内存缓存一次性写入管道（不访问磁盘，也不需要写入线程），否则直接使用输入文件
+    """
+    size = case['input_size']
+    if size <= Config.JUDGE_STDIN_PIPE_MAX_BYTES:
+        data = read_case_file(case['input'], case.get('version'), size, Config.JUDGE_STDIN_PIPE_MAX_BYTES)
+        if data is not None:
+            read_fd, write_fd = os.pipe()
+            try:
+                # 管道放不下时写入会阻塞，改用输入文件
+                if len(data) <= _pipe_capacity(write_fd, len(data)):
+                    view = memoryview(data)
+                    while view:
+                        view = view[os.write(write_fd, view):]
+                    return os.fdopen(read_fd, 'rb')
+            except Exception:
+                os.close(read_fd)
+                raise
+            finally:
+                os.close(write_fd)
+            os.close(read_fd)
+    return open(case['input'], 'rb')
+
+
+def _expected_chunks(case):
+    """预期输出的字节块，优先取内存缓存"""
+    data = read_case_file(case['output'], case.get('version'), case['output_size'])
+    if data is not None:
+        yield data
+        return
+    with open(case['output'], 'rb') as f:
+        yield from iter(lambda: f.read(64 * 1024), b'')
+
+
+def _check_output(stdout, case, spool_file, checker=None, timing=None, deadline=None):
+    """
+    读取选手程序输出并与预期输出比较
+    使用特殊判题程序时只把输出完整写入临时文件，程序结束后再交给特殊判题程序
+    :param timing: 同 _read_chunks
+    :param deadline: 同 _read_chunks
+    :return: (mismatch, abort)，mismatch 同 _compare_output；abort 表示程序可能仍在输出，应提前结束
+    """
+    chunks = _read_chunks(stdout, Config.JUDGE_OUTPUT_LIMIT, timing, deadline)
+    if checker:
+        for _ in _tee(chunks, spool_file):
+            pass
+        spool_file.flush()
+        return None, False
+
+    expected_digest = case.get('output_digest')
+    if expected_digest is None:
+        # 没有预期输出摘要时边运行边逐行比较
+        mismatch = _compare_output(normalized_lines(split_lines(chunks)),
+                                   normalized_lines(split_lines(_expected_chunks(case))))
+        # 实际输出已经结束（程序可能崩溃）时不提前结束，保留运行错误等结果
+        return mismatch, mismatch is not None and mismatch[2] is not None
+
+    # 快速路径：规范化选手输出并计算摘要，与上传时记录的预期输出摘要比较，不读取预期输出文件
+    # 输出同时写入临时文件，只在摘要不一致时用于逐行比较、定位第一处不同
+    digest, _ = output_digest(normalized_lines(split_lines(_tee(chunks, spool_file))),
+                              max_size=case['output_normalized_size'])
+    if digest == expected_digest:
+        return None, False
+
+    spool_file.seek(0)
+    mismatch = _compare_output(
+        normalized_lines(split_lines(iter(lambda: spool_file.read(64 * 1024), b''))),
+        normalized_lines(split_lines(_expected_chunks(case)))
+    )
+    # 规范化后的输出已经超过预期输出的长度
+    return mismatch, digest is None
+
+
+def _spawn(command, time_limit, memory_limit, watchdog_seconds, **kwargs):
+    """
+    启动选手程序，并由内核限制 CPU 时间和地址空间：
+    优先交给常驻运行器池（由运行器负责墙钟时间看门狗），其次经由一次性运行器启动，都不可用时直接启动
+    :param time_limit: 时间限制（毫秒）
+    :param memory_limit: 内存限制（字节）
+    :param watchdog_seconds: 墙钟时间上限（秒），只有常驻运行器使用，其余情况由调用方计时
+    :return: (进程对象, 统计管道读端)，未使用一次性运行器时读端为 None
+    """
+    cpu_seconds = max(1, math.ceil(time_limit / 1000))
+    address_space = memory_limit + Config.JUDGE_ADDRESS_SPACE_MARGIN
+
+    pool = get_runner_pool()
+    if pool:
+        stdout_read, stdout_write = os.pipe()
+        try:
+            process = pool.spawn(command, cpu_seconds, address_space, int(watchdog_seconds * 1000),
+                                 kwargs['stdin'].fileno(), stdout_write, kwargs['stderr'].fileno())
+        except Exception:
+            os.close(stdout_read)
+            raise
+        finally:
+            os.close(stdout_write)
+        process.stdout = os.fdopen(stdout_read, 'rb')
+        return process, None
+
+    runner = get_runner_path()
+    if not runner:
+        return subprocess.Popen([command], **kwargs), None
+
+    stat_read, stat_write = os.pipe()
     try:
-        # 使用psutil来更好地控制子进程
-        process = psutil.Popen(
-            command,
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            shell=False,  # 必须设置为False才能准确监控目标进程
-            text=True
+        process = subprocess.Popen(
+            [runner, str(stat_write), str(cpu_seconds), str(address_space), command],
+            pass_fds=(stat_write,),
+            **kwargs
         )
+    except Exception:
+        os.close(stat_read)
+        raise
+    finally:
+        os.close(stat_write)
+    return process, stat_read
 
-        # 内存监控函数
-        def monitor_memory():
-            nonlocal max_memory
-            while memory_monitor_running:
-                try:
-                    # 获取进程及其所有子进程的内存使用
-                    mem = process.memory_info().rss
-                    for child in process.children(recursive=True):
-                        try:
-                            mem += child.memory_info().rss
-                        except (psutil.NoSuchProcess, psutil.AccessDenied):
-                            pass
-
-                    if mem > max_memory:
-                        max_memory = mem
-
-                    # 控制采样频率
-                    time.sleep(0.01)  # 10ms采样间隔
-                except (psutil.NoSuchProcess, psutil.AccessDenied):
-                    break
-
-        # 启动内存监控线程
-        monitor_thread = threading.Thread(target=monitor_memory)
-        monitor_thread.daemon = True
-        monitor_thread.start()
 
-        try:
-            # 发送输入数据
-            stdout, stderr = process.communicate(
-                input=input_data,
-                timeout=time_limit
-            )
+def _wait_for_exit(process, stat_fd):
+    """
+    回收子进程，返回 (退出码, 峰值内存字节数, CPU 时间毫秒)
+    峰值内存和 CPU 时间取自内核回收进程时给出的统计，不需要轮询采样
+    """
+    if isinstance(process, PooledProcess):
+        status, max_rss, user_us, system_us = process.wait()
+        return os.waitstatus_to_exitcode(status), max_rss * MAXRSS_UNIT, (user_us + system_us) / 1000
 
-            # 计算执行时间
-            execution_time = (time.time() - start_time) * 1000  # 毫秒
-
-            # 停止内存监控
-            memory_monitor_running = False
-            monitor_thread.join(timeout=0.1)
-
-            # 检查运行结果
-            if process.returncode != 0:
-                if "MemoryError" in stderr:
-                    return {
-                        'status': 'Memory Limit Exceeded',
-                        'execution_time': execution_time,
-                        'memory_used': max_memory / (1024 * 1024),  # MB
-                        'case_id': os.path.basename(input_file)[:-3]
-                    }
-                else:
-                    return {
-                        'status': 'Runtime Error',
-                        'message': stderr,
-                        'execution_time': execution_time,
-                        'memory_used': max_memory / (1024 * 1024),  # MB
-                        'case_id': os.path.basename(input_file)[:-3]
-                    }
-
-            if execution_time > time_limit :  # 比较毫秒
-                return {
-                    'status': 'Time Limit Exceeded',
-                    'execution_time': execution_time,
-                    'memory_used': max_memory / (1024 * 1024),  # MB
-                    'case_id': os.path.basename(input_file)[:-3]
-                }
-
-            if max_memory > memory_limit:
-                return {
-                    'status': 'Memory Limit Exceeded',
-                    'execution_time': execution_time,
-                    'memory_used': max_memory / (1024 * 1024),  # MB
-                    'case_id': os.path.basename(input_file)[:-3]
-                }
-
-            # 比较输出
-            if _compare_output(stdout.strip(), expected_output):
-                return {
-                    'status': 'Accepted',
-                    'execution_time': execution_time,
-                    'memory_used': max_memory / (1024 * 1024),  # MB
-                    'case_id': os.path.basename(input_file)[:-3]
-                }
-            else:
-                return {
-                    'status': 'Wrong Answer',
-                    'expected': expected_output,
-                    'actual': stdout.strip(),
-                    'execution_time': execution_time,
-                    'memory_used': max_memory / (1024 * 1024),  # MB
-                    'case_id': os.path.basename(input_file)[:-3]
-                }
-
-        except subprocess.TimeoutExpired:
-            memory_monitor_running = False
+    if stat_fd is not None:
+        try:
+            process.wait()
+            data = os.read(stat_fd, 256).split()
+        finally:
+            os.close(stat_fd)
+        if len(data) == 4:
+            status, max_rss, user_us, system_us = map(int, data)
+            return os.waitstatus_to_exitcode(status), max_rss * MAXRSS_UNIT, (user_us + system_us) / 1000
+        # 运行器本身被杀死（如超时）时没有统计数据
+        return process.returncode, 0, 0
+
+    if hasattr(os, 'wait4'):
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        return process.returncode, rusage.ru_maxrss * MAXRSS_UNIT, (rusage.ru_utime + rusage.ru_stime) * 1000
+
+    # Windows 没有 wait4，读取进程句柄上记录的峰值工作集和 CPU 时间
+    process.wait()
+    try:
+        info = psutil.Process(process.pid)
+        cpu = info.cpu_times()
+        return process.returncode, info.memory_info().peak_wset, (cpu.user + cpu.system) * 1000
+    except (psutil.Error, AttributeError):
+        return process.returncode, 0, 0
+
+
+def _kill(process, sig=None):
+    """
+    结束选手程序（运行器启动的子进程与其在同一进程组中）
+    默认发送 SIGKILL；发送 SIGTERM 时运行器会结束选手程序并照常输出资源使用统计
+    常驻运行器启动的程序总是直接 SIGKILL，统计由作为父进程的运行器照常回复
+    """
+    if isinstance(process, PooledProcess):
+        process.kill()
+        return
+    try:
+        if os.name == 'nt':
             process.kill()
-            monitor_thread.join(timeout=0.1)
-            return {
-                'status': 'Time Limit Exceeded',
-                'execution_time': time_limit,
-                'memory_used': max_memory / (1024 * 1024),  # MB
-                'case_id': os.path.basename(input_file)[:-3]
-            }
+        else:
+            os.killpg(process.pid, sig or signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def _run_checker(checker, case, actual_path):
+    """
+    运行特殊判题程序：checker <输入文件> <预期输出文件> <选手输出文件>
+    退出码 0 为答案正确，1、2 为答案错误（testlib 的 WA/PE），其他视为特殊判题程序自身出错
+    :return: (状态, 特殊判题程序的提示信息)
+    """
+    result = subprocess.run(
+        [checker, case['input'], case['output'], actual_path],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        timeout=Config.JUDGE_CHECKER_TIMEOUT
+    )
+    message = (result.stderr or result.stdout)[:4096].decode('utf-8', errors='replace').strip()
+    if result.returncode == 0:
+        return 'Accepted', message
+    if result.returncode in (1, 2):
+        return 'Wrong Answer', message
+    return 'System Error', f"特殊判题程序出错（退出码 {result.returncode}）: {message}"
+
+
+def _run_test_case(command, case, time_limit, memory_limit, checker=None, on_spawn=None):
+    """
+    运行一个测试点并判定结果
+    :param on_spawn: 选手程序启动后以进程对象调用，供并发判题在确定结果后提前结束该程序
+    """
+    case_id = os.path.basename(case['input'])[:-3]
+
+    def make_result(status, **extra):
+        result = {
+            'status': status,
+            'execution_time': cpu_time,
+            'cpu_time': cpu_time,
+            'wall_time': wall_time,
+            'memory_used': max_memory / (1024 * 1024),  # MB
+            'case_id': case_id,
+            'timing': timing
+        }
+        result.update(extra)
+        return result
+
+    # 超时以 CPU 时间判定；墙钟时间只用于结束长时间空等（sleep、等待输入）的程序
+    # 看门狗：墙钟时间超过 时间限制 * 倍数 + 宽限 时结束整个进程组（time_limit 单位为毫秒）
+    watchdog_seconds = (time_limit * Config.JUDGE_WALL_TIME_FACTOR + Config.JUDGE_TIME_GRACE_MS) / 1000
+    timed_out = threading.Event()
+    process = None
+    # 使用特殊判题程序时选手输出写入具名临时文件，判题结束后删除
+    actual_path = None
+    # 各阶段耗时（毫秒）：启动、运行（启动完成到回收，边运行边比较）、比较（输出结束之后的比较和特殊判题）
+    timing = {'spawn_ms': 0.0, 'run_ms': 0.0, 'compare_ms': 0.0}
+
+    try:
+        # stdin 来自内存缓存写满的管道或输入文件；stderr 写入临时文件，避免与 stdout 同时读取管道时死锁
+        spool = tempfile.NamedTemporaryFile(delete=False) if checker else tempfile.TemporaryFile()
+        if checker:
+            actual_path = spool.name
+        with spool as spool_file, _open_stdin(case) as stdin_file, tempfile.TemporaryFile() as stderr_file:
+            start_time = time.perf_counter()
+            process, stat_fd = _spawn(
+                command,
+                time_limit,
+                memory_limit,
+                watchdog_seconds,
+                stdin=stdin_file,
+                stdout=subprocess.PIPE,
+                stderr=stderr_file,
+                shell=False,
+                start_new_session=os.name != 'nt'  # 独立进程组，超时时整组结束
+            )
+            spawned_time = time.perf_counter()
+            timing['spawn_ms'] = (spawned_time - start_time) * 1000
+            if on_spawn is not None:
+                on_spawn(process)
+
+            def on_timeout():
+                timed_out.set()
+                _kill(process)
+
+            # 常驻运行器自己计时，不需要看门狗线程
+            watchdog = None
+            if not isinstance(process, PooledProcess):
+                watchdog = threading.Timer(watchdog_seconds, on_timeout)
+                watchdog.daemon = True
+                watchdog.start()
+
+            # 边运行边检查输出；确定答案错误或输出超限时立即结束程序
+            # 读取输出同样以看门狗时间为限：选手程序 fork 出的进程可能在程序结束后仍持有 stdout
+            mismatch = None
+            output_exceeded = False
+            output_timing = {}
+            try:
+                mismatch, aborted = _check_output(process.stdout, case, spool_file, checker, output_timing,
+                                                  deadline=start_time + watchdog_seconds)
+            except OutputLimitExceeded:
+                output_exceeded = aborted = True
+            except WallTimeExceeded:
+                aborted = False
+                on_timeout()
+            checked_time = time.perf_counter()
+            timing['compare_ms'] = (checked_time - output_timing.get('output_end', checked_time)) * 1000
+            if aborted:
+                _kill(process, signal.SIGTERM)
+
+            try:
+                process.stdout.close()
+                returncode, max_memory, cpu_time = _wait_for_exit(process, stat_fd)
+            finally:
+                if watchdog is not None:
+                    watchdog.cancel()
+
+            exited_time = time.perf_counter()
+            wall_time = (exited_time - start_time) * 1000  # 毫秒
+            timing['run_ms'] = (exited_time - spawned_time) * 1000
+
+            stderr_file.seek(0)
+            stderr = stderr_file.read(4096).decode('utf-8', errors='replace')
+
+        if output_exceeded:
+            return make_result('Output Limit Exceeded')
+
+        # 程序不是被判题提前结束时，检查运行结果
+        if not aborted:
+            # 被看门狗结束，或被 CPU 时间限制结束（软限制 SIGXCPU，硬限制 SIGKILL）
+            if timed_out.is_set() or getattr(process, 'timed_out', False) or returncode in CPU_LIMIT_SIGNALS:
+                return make_result('Time Limit Exceeded')
+
+            if returncode != 0:
+                # 地址空间受限时内存分配失败，程序通常以 bad_alloc 异常或段错误结束
+                if "MemoryError" in stderr or "bad_alloc" in stderr or max_memory > memory_limit:
+                    return make_result('Memory Limit Exceeded')
+                return make_result('Runtime Error', message=stderr)
+
+        if cpu_time > time_limit:  # 比较毫秒
+            return make_result('Time Limit Exceeded')
+
+        if max_memory > memory_limit:
+            return make_result('Memory Limit Exceeded')
+
+        if checker:
+            checker_start = time.perf_counter()
+            status, message = _run_checker(checker, case, actual_path)
+            timing['compare_ms'] += (time.perf_counter() - checker_start) * 1000
+            return make_result(status, message=message) if message else make_result(status)
+
+        if mismatch is None:
+            return make_result('Accepted')
+        line_no, expected, actual = mismatch
+        return make_result('Wrong Answer', line=line_no, expected=_preview(expected), actual=_preview(actual))
 
     except Exception as e:
-        memory_monitor_running = False
-        if 'monitor_thread' in locals():
-            monitor_thread.join(timeout=0.1)
+        if isinstance(process, PooledProcess):
+            process.abandon()
+        elif process is not None and process.poll() is None:
+            _kill(process)
         return {
             'status': 'System Error',
             'message': str(e),
-            'case_id': os.path.basename(input_file)[:-3]
+            'case_id': case_id
         }
-
-
-def _judge_cpp(code, test_cases_dir, time_limit, memory_limit):
-    import tempfile
-    import uuid
-
-    # 创建唯一临时文件名
-    temp_dir = tempfile.gettempdir()
-    unique_id = str(uuid.uuid4())[:8]
-    source_file = os.path.join(temp_dir, f"temp_{unique_id}.cpp")
-    executable = os.path.join(temp_dir, f"temp_{unique_id}.exe" if os.name == 'nt' else f"temp_{unique_id}")
-
-    try:
-        # 保存代码到临时文件
-        with open(source_file, 'w', encoding='utf-8') as f:
-            f.write(code)
-
-        # 编译C++代码
-        compile_result = subprocess.run(
-            ["g++", source_file, "-o", executable, "-O2", "-std=c++11"],
-            stderr=subprocess.PIPE,
-            cwd=temp_dir  # 在临时目录中编译
+    finally:
+        if actual_path:
+            try:
+                os.remove(actual_path)
+            except OSError:
+                pass
+
+
+def _run_cases_serial(executable, test_cases, time_limit, memory_limit, checker=None):
+    """按顺序运行测试点，遇到第一个未通过的测试点即停止"""
+    results = []
+    for case in test_cases:
+        result = _run_test_case(
+            executable,
+            case,
+            time_limit,
+            memory_limit,
+            checker
         )
+        results.append(result)
+
+        if result['status'] != 'Accepted':
+            break
+
+    return results
+
+
+# 所有提交共享的测试点线程池，保证同一 worker 进程内同时运行的测试点数不超过核数
+_case_executor = None
+_case_executor_lock = threading.Lock()
+
+
+def _get_case_executor():
+    global _case_executor
+    with _case_executor_lock:
+        if _case_executor is None:
+            _case_executor = ThreadPoolExecutor(max_workers=Config.JUDGE_MAX_WORKERS,
+                                                thread_name_prefix='judge-case')
+        return _case_executor
+
+
+def _run_cases_parallel(executable, test_cases, time_limit, memory_limit, checker=None):
+    """
+    并发运行测试点，结果与串行模式一致（截断到按顺序第一个未通过的测试点）：
+    某个测试点未通过后，编号更大的测试点不再启动，已在运行的直接结束、结果丢弃；
+    编号更小的测试点继续运行，它们仍可能决定最终结果
+    """
+    executor = _get_case_executor()
+    lock = threading.Lock()
+    # 目前已知的按顺序第一个未通过的测试点下标，以及正在运行的选手程序：测试点下标 -> 进程对象
+    state = {'failed': len(test_cases)}
+    running = {}
+
+    def spawned(index, process):
+        with lock:
+            running[index] = process
+            cancelled = index > state['failed']
+        if cancelled:
+            _kill(process)
+
+    def run(index, case):
+        with lock:
+            if index > state['failed']:
+                return None
+        try:
+            result = _run_test_case(executable, case, time_limit, memory_limit, checker,
+                                    on_spawn=lambda process: spawned(index, process))
+        finally:
+            with lock:
+                running.pop(index, None)
+        if result['status'] == 'Accepted':
+            return result
+
+        with lock:
+            if index > state['failed']:
+                # 在更早的测试点之后，结果会被截断（也可能是被提前结束的）
+                return None
+            state['failed'] = index
+            cancelled = [p for i, p in running.items() if i > index and p.returncode is None]
+        for process in cancelled:
+            _kill(process)
+        return result
+
+    futures = {executor.submit(run, index, case): index for index, case in enumerate(test_cases)}
+
+    results = [None] * len(test_cases)
+    for future in as_completed(futures):
+        if future.cancelled():
+            continue
+        results[futures[future]] = future.result()
+        if state['failed'] < len(test_cases):
+            # 尚未开始的测试点（编号都大于已开始的测试点）直接从队列中移除，不再占用线程池
+            for f in futures:
+                f.cancel()
+
+    ordered = []
+    for result in results:
+        if result is None:
+            break
+        ordered.append(result)
+        if result['status'] != 'Accepted':
+            break
+
+    return ordered
+
+
+def _run_cases_all(executable, test_cases, time_limit, memory_limit, parallel, checker=None):
+    """运行全部测试点（oi 模式），不因未通过的测试点提前停止，结果按测试点顺序返回"""
+    if not parallel or len(test_cases) <= 1:
+        return [_run_test_case(executable, case, time_limit, memory_limit, checker) for case in test_cases]
+
+    executor = _get_case_executor()
+    futures = [executor.submit(_run_test_case, executable, case, time_limit, memory_limit, checker)
+               for case in test_cases]
+    return [future.result() for future in futures]
+
+
+def _weighted_score(results, case_weights):
+    """
+    按测试点权重计算得分（满分 100）
+    :param case_weights: {测试点ID: 权重}，测试点ID 与结果中的 case_id 一致，未设置或不合法的权重按 1 计算
+    """
+    if not isinstance(case_weights, dict):
+        case_weights = {}
+    total = earned = 0
+    for result in results:
+        try:
+            weight = float(case_weights.get(result['case_id'], 1))
+        except (TypeError, ValueError):
+            weight = 1
+        if not math.isfinite(weight) or weight < 0:
+            weight = 1
+        total += weight
+        if result['status'] == 'Accepted':
+            earned += weight
+    return round(earned * 100 / total, 2) if total else 0
+
+
+# 特殊判题程序：源码哈希 -> 可执行文件路径（每个进程只读取、查找一次）
+_checker_paths = {}
+
+
+def _get_checker(checker):
+    """
+    获取特殊判题程序的可执行文件
+    上传时已编译进编译缓存（同一判题机的所有 worker 共享），这里只在进程内第一次使用或缓存被淘汰时读取源码
+    :param checker: 清单中的 checker 信息
+    :return: (可执行文件路径, 编译错误信息)
+    """
+    executable = _checker_paths.get(checker['sha256'])
+    if executable and os.path.exists(executable):
+        return executable, None
+
+    with open(checker['source'], 'r', encoding='utf-8') as f:
+        code = f.read()
+    executable, compile_error = compile_cpp(code)
+    if compile_error is not None or not executable:
+        return None, compile_error or '可执行文件未生成'
+    _checker_paths[checker['sha256']] = executable
+    return executable, None
+
+
+def _judge_cpp(code, test_cases_dir, time_limit, memory_limit, parallel=None, judge_mode='acm', case_weights=None):
+    # 各阶段耗时（毫秒）和可执行文件大小，记录在结果的 timing 中
+    timing = {'compile_ms': 0.0, 'binary_size': 0, 'run_ms': 0.0}
+
+    # 编译C++代码（相同代码直接命中编译缓存）
+    compile_start = time.perf_counter()
+    executable, compile_error = compile_cpp(code)
+    timing['compile_ms'] = (time.perf_counter() - compile_start) * 1000
+    if compile_error is not None:
+        return {
+            "status": "Compile Error",
+            "message": compile_error,
+            "timing": timing
+        }
 
-        if compile_result.returncode != 0:
-            return {
-                "status": "Compile Error",
-                "message": compile_result.stderr.decode('utf-8')
-            }
-
-        # 确保可执行文件存在
-        if not os.path.exists(executable):
+    # 确保可执行文件存在
+    if not executable or not os.path.exists(executable):
+        return {
+            "status": "System Error",
+            "message": "可执行文件未生成",
+            "timing": timing
+        }
+    timing['binary_size'] = os.path.getsize(executable)
+
+    # 遍历测试用例
+    manifest = load_manifest(test_cases_dir)
+    test_cases = manifest['cases']
+    checker = None
+    if manifest.get('checker'):
+        checker, checker_error = _get_checker(manifest['checker'])
+        if checker_error is not None:
             return {
                 "status": "System Error",
-                "message": "可执行文件未生成"
+                "message": f"特殊判题程序编译失败: {checker_error}",
+                "timing": timing
             }
+    if parallel is None:
+        parallel = Config.JUDGE_PARALLEL_CASES
 
-        # 遍历测试用例
-        test_cases = _get_test_cases(test_cases_dir)
-        results = []
-
-        for case in test_cases:
-            result = _run_test_case(
-                executable,
-                case['input'],
-                case['output'],
-                time_limit,
-                memory_limit
-            )
-            results.append(result)
-
-            if result['status'] != 'Accepted':
-                break
-
+    run_start = time.perf_counter()
+    if judge_mode == 'oi':
+        results = _run_cases_all(executable, test_cases, time_limit, memory_limit, parallel, checker)
+        timing['run_ms'] = (time.perf_counter() - run_start) * 1000
         return {
-            "status": results[-1]['status'] if results else 'No Test Cases',
+            "status": next((r['status'] for r in results if r['status'] != 'Accepted'),
+                           'Accepted' if results else 'No Test Cases'),
             "details": results,
             "passed": sum(1 for r in results if r['status'] == 'Accepted'),
-            "total": len(results)
+            "total": len(results),
+            "judge_mode": judge_mode,
+            "score": _weighted_score(results, case_weights or {}),
+            "timing": timing
         }
 
-    finally:
-        # 确保清理临时文件
-        try:
-            if os.path.exists(source_file):
-                os.remove(source_file)
-            if os.path.exists(executable):
-                os.remove(executable)
-        except Exception as e:
-            print(f"清理临时文件时出错: {str(e)}")
+    if parallel and len(test_cases) > 1:
+        results = _run_cases_parallel(executable, test_cases, time_limit, memory_limit, checker)
+    else:
+        results = _run_cases_serial(executable, test_cases, time_limit, memory_limit, checker)
+    timing['run_ms'] = (time.perf_counter() - run_start) * 1000
+
+    return {
+        "status": results[-1]['status'] if results else 'No Test Cases',
+        "details": results,
+        "passed": sum(1 for r in results if r['status'] == 'Accepted'),
+        "total": len(results),
+        "timing": timing
+    }
+
+
+def warmup_problems(problem_ids):
+    """
+    预热判题 worker：拉取最新版本的测试数据，加载清单并把测试数据读入内存缓存，并提前构建预编译头和判题运行器
+    :param problem_ids: 题目ID列表
+    :return: {题目ID: 测试点数}，没有测试用例的题目为 None
+    """
+    get_pch_include_dir()
+    get_runner_path()
+
+    result = {}
+    for problem_id in problem_ids:
+        with use_testdata(problem_id) as test_cases_dir:
+            if not test_cases_dir:
+                result[problem_id] = None
+                continue
+
+            manifest = load_manifest(test_cases_dir)
+            if manifest.get('checker'):
+                _get_checker(manifest['checker'])
+            test_cases = manifest['cases']
+            for case in test_cases:
+                if case['input_size'] <= Config.JUDGE_STDIN_PIPE_MAX_BYTES:
+                    read_case_file(case['input'], case['version'], case['input_size'],
+                                   Config.JUDGE_STDIN_PIPE_MAX_BYTES)
+                read_case_file(case['output'], case['version'], case['output_size'])
+            result[problem_id] = len(test_cases)
+
+    return result
+
+
+def verdict_cache_key(problem_id, testcase_version, language, code, question):
+    """
+    相同提交的判题结果缓存键
+    :param question: 判题所需的题目信息，时间、内存限制或判题模式修改后不再命中旧结果
+    """
+    params = [problem_id, testcase_version, language, question['time_limit'], question['memory_limit'],
+              question.get('judge_mode', 'acm'), question.get('case_weights')]
+    digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(normalize_source(code).encode('utf-8'))
+    return VERDICT_CACHE_KEY.format(digest.hexdigest())
+
+
+def get_cached_verdict(cache_key):
+    """
+    获取相同提交在 JUDGE_VERDICT_CACHE_TTL 内的判题结果
+    :return: 判题结果（带 cached 标记）；没有缓存时返回 None
+    """
+    raw = redis_wrapper.get(cache_key)
+    if not raw:
+        return None
+    result = json.loads(raw)
+    result['cached'] = True
+    return result
+
+
+def cache_verdict(cache_key, result):
+    """缓存判题结果（不含阶段耗时），System Error 和超时不缓存"""
+    if result.get('status') in UNCACHEABLE_STATUSES:
+        return
+    redis_wrapper.setex(cache_key, Config.JUDGE_VERDICT_CACHE_TTL, json.dumps(strip_timing(result)))
+
+
+def record_judge_result(user_id, problem_id, result, race_id=0, code=None, language='cpp'):
+    """
+    记录做题结果：提交记录（源码、结果、耗时和内存，用于做题记录和重测）、热力图、题目状态和比赛排名
+    :param code: 提交的源码，为 None 时该提交不参与重测
+    """
+    is_passed = result['status'] == 'Accepted'
+    if race_id and race_id > 0:
+        # 比赛提交与排行榜在同一事务中保存，重测修正排行榜时已保存的提交都已计入
+        submission = save_submission(user_id, problem_id, code, language, result, race_id=race_id, commit=False)
+        update_race_rank(user_id, problem_id, is_passed, race_id)
+        keep_submission(submission)
+    else:
+        save_submission(user_id, problem_id, code, language, result)
+
+    if is_passed:
+        update_user_heatmap(user_id, dt.now().strftime("%Y-%m-%d"))
+    update_user_question_status(user_id, problem_id, is_passed, race_id=race_id)
+
+
+def judge_submission(user_id, problem_id, code, language, race_id=0, submitted_at=None, lane=None):
+    """
+    完整的判题流程（由判题队列的 worker 调用）：编译运行并记录做题结果
+    :param submitted_at: 提交进入判题队列的时间戳（秒），用于统计排队时间
+    :param lane: 提交所在的优先级通道，排队时间按通道分别统计
+    :return: 判题结果字典
+    """
+    judge_start = time.perf_counter()
+    queue_wait_ms = max(0.0, (time.time() - submitted_at) * 1000) if submitted_at else None
+
+    question = get_judge_question(problem_id)
+    if not question:
+        return {"status": "System Error", "message": "题目不存在"}
+
+    time_limit = question['time_limit']
+    memory_limit = question['memory_limit'] * 1024 * 1024
+    # 任意节点都可以判任意题目：本机测试数据不是最新版本时先从 Redis 拉取，判题期间该版本的快照不会被清理
+    with use_testdata(problem_id) as test_cases_dir:
+        if not test_cases_dir:
+            return {"status": "System Error", "message": "测试用例不存在"}
+
+        if language != 'cpp':
+            return {"status": "System Error", "message": "不支持的语言"}
+
+        # 排队期间相同的提交可能已经判完（如连续点击提交），直接使用其结果
+        cache_key = verdict_cache_key(problem_id, load_manifest(test_cases_dir)['version'], language, code, question)
+        result = get_cached_verdict(cache_key)
+        slot_wait_ms = None
+        if result is None:
+            wait_start = time.perf_counter()
+            with _judge_slots:
+                slot_wait_ms = (time.perf_counter() - wait_start) * 1000
+                result = _judge_cpp(code, test_cases_dir, time_limit, memory_limit,
+                                    judge_mode=question.get('judge_mode', 'acm'),
+                                    case_weights=question.get('case_weights'))
+            cache_verdict(cache_key, result)
+
+    record_judge_result(user_id, problem_id, result, race_id=race_id, code=code, language=language)
+
+    timing = result.setdefault('timing', {})
+    timing['queue_wait_ms'] = queue_wait_ms
+    timing['slot_wait_ms'] = slot_wait_ms
+    timing['lane'] = lane
+    timing['judge_ms'] = (time.perf_counter() - judge_start) * 1000
+    timing['total_ms'] = timing['judge_ms'] + (queue_wait_ms or 0.0)
+    record_judge_timing(result)
+
+    return result
+
+
+def rejudge_submission(submission_id):
+    """
+    重测一条保存的提交并更新提交记录；是否通过发生变化时，在同一事务中（锁定相关记录）
+    按增量修正题目状态和比赛排行榜，不影响其他提交和同时进行的判题
+    判题失败（题目或测试数据不存在、System Error）时保留原结果
+    :return: (原结果, 新结果)；提交记录不存在时返回 None
+    """
+    submission = Submission.query.get(submission_id)
+    if not submission:
+        return None
+
+    question = get_judge_question(submission.question_id)
+    if not question or submission.language != 'cpp':
+        return submission.status, 'System Error'
+
+    with use_testdata(submission.question_id) as test_cases_dir:
+        if not test_cases_dir:
+            return submission.status, 'System Error'
+
+        # 同一道题中相同的源码只判一次，其余直接使用缓存结果
+        cache_key = verdict_cache_key(submission.question_id, load_manifest(test_cases_dir)['version'],
+                                      submission.language, submission.code, question)
+        result = get_cached_verdict(cache_key)
+        if result is None:
+            with _judge_slots:
+                result = _judge_cpp(submission.code, test_cases_dir, question['time_limit'],
+                                    question['memory_limit'] * 1024 * 1024,
+                                    judge_mode=question.get('judge_mode', 'acm'),
+                                    case_weights=question.get('case_weights'))
+            cache_verdict(cache_key, result)
+
+    if result['status'] == 'System Error':
+        return submission.status, result['status']
+
+    try:
+        submission = Submission.query.filter_by(uid=submission_id).with_for_update().populate_existing().first()
+        old_status, old_passed = submission.status, submission.is_passed
+        update_submission_result(submission, result)
+        if submission.is_passed != old_passed:
+            rejudge_question_status(submission, 1 if submission.is_passed else -1)
+            if submission.race_id > 0:
+                rejudge_race_rank(submission, old_passed)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        raise e
+    return old_status, result['status']
@@ -1,7 +1,10 @@
 from .panel_service import update_user_heatmap
 from .race_service import update_race_rank
-from .. import db
-from ..models import UserQuestionStatus, QuestionsData, User
+from .submission_service import keep_submission, save_submission
+from .. import db, redis_wrapper
+from ..models import UserQuestionStatus, QuestionsData, Submission
+from config import Config
+import json
 import math
 from datetime import datetime as dt
 
@@ -126,45 +129,53 @@ def get_question_detail(question_id):
     }
 
 
-def add_question_record(user_id, question_uid, is_passed):
-    try:
-        user = User.query.get(user_id)
-        if not user:
-            raise ValueError("用户不存在")
-
-        # 初始化
-        if user.questions is None:
-            user.questions = []
-
-        # 查找是否已有该题目的记录
-        existing_index = None
-        for i, record in enumerate(user.questions):
-            if record["question_uid"] == question_uid:
-                existing_index = i
-                break
-
-        # 准备记录数据
-        new_record = {
-            "question_uid": question_uid,
-            "submit_time": dt.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "is_passed": is_passed
-        }
+def cache_judge_question(question):
+    """
+    缓存判题所需的题目信息
+    :param question: QuestionsData 对象
+    :return: 题目信息字典
+    """
+    question_json = question.question or {}
+    info = {
+        "uid": question.uid,
+        "time_limit": question_json.get("time_limit", 1000),
+        "memory_limit": question_json.get("memory_limit", 128),
+        "judge_mode": question_json.get("judge_mode", "acm"),
+        "case_weights": question_json.get("case_weights") or {},
+        "topic": question.topic
+    }
+    redis_wrapper.setex(f"judge:question:{question.uid}", Config.JUDGE_QUESTION_CACHE_TTL, json.dumps(info))
+    return info
 
-        # 更新或追加
-        if existing_index is not None:
-            user.questions[existing_index].update(new_record)
-        else:
-            user.questions.append(new_record)
 
-        # 标记变更并提交
-        from sqlalchemy.orm.attributes import flag_modified
-        flag_modified(user, "questions")
-        db.session.commit()
+def get_judge_question(question_id):
+    """
+    获取判题所需的题目信息（时间限制、内存限制等），优先读取缓存
+    :param question_id: 题目ID
+    :return: 题目信息字典，题目不存在时返回 None
+    """
+    cached = redis_wrapper.get(f"judge:question:{question_id}")
+    if cached:
+        return json.loads(cached)
 
-        return True
-    except Exception as e:
-        db.session.rollback()
-        raise e
+    question = QuestionsData.query.filter_by(uid=question_id).first()
+    if not question:
+        return None
+    return cache_judge_question(question)
+
+
+def invalidate_judge_question(question_id):
+    """题目被修改或删除后清除缓存"""
+    redis_wrapper.delete(f"judge:question:{question_id}")
+
+
+def add_question_record(user_id, question_uid, is_passed, race_id=0, commit=True):
+    """
+    记录 AI 评判的做题结果（追加一条不含源码的提交记录）
+    :return: 提交记录
+    """
+    return save_submission(user_id, int(question_uid), None, None,
+                           {"status": "Accepted" if is_passed else "Wrong Answer"}, race_id=race_id, commit=commit)
 
 
 def update_user_question_status(user_id, question_id, is_correct, race_id=0):
@@ -180,7 +191,7 @@ def update_user_question_status(user_id, question_id, is_correct, race_id=0):
         user_id=user_id,
         question_id=question_id,
         race_id=race_id
-    ).first()
+    ).with_for_update().first()
 
     if existing_record:
         # 更新已有记录
@@ -211,7 +222,7 @@ def update_user_question_status(user_id, question_id, is_correct, race_id=0):
             race_id=race_id,
             question_id=question_id,
             user_id=0  # 全局统计专用
-        ).first()
+        ).with_for_update().first()
 
         if not global_stats:
             global_stats = UserQuestionStatus(
@@ -255,6 +266,36 @@ def update_user_question_status(user_id, question_id, is_correct, race_id=0):
     db.session.commit()
 
 
+def rejudge_question_status(submission, delta):
+    """
+    重测改变了提交是否通过时，按增量修正用户和全局（user_id=0）的解决数、作答状态和一血（不提交事务）
+    提交数不变；一血在该题该比赛的提交记录完整（条数等于全局提交数）时按记录重新确定；
+    记录不完整（有提交记录表之前的历史）时，一血用户的提交改判为未通过则改为最早的仍然通过的已保存提交（没有时清空），
+    原来没有一血且新增通过时补上
+    :param delta: 1 表示改判为通过，-1 表示改判为未通过
+    """
+    for user_id in (submission.user_id, 0):
+        record = UserQuestionStatus.query.filter_by(
+            race_id=submission.race_id,
+            user_id=user_id,
+            question_id=submission.question_id
+        ).with_for_update().first()
+        if record is None:
+            continue
+        record.solve = max(0, (record.solve or 0) + delta)
+        record.state = '已通过' if record.solve else '未通过'
+        if user_id != 0:
+            continue
+
+        stored = Submission.query.filter_by(question_id=submission.question_id, race_id=submission.race_id)
+        if stored.count() == record.submit or (delta < 0 and record.first_blood == submission.user_id):
+            first = stored.filter(Submission.is_passed.is_(True)) \
+                .order_by(Submission.created_at, Submission.uid).first()
+            record.first_blood = first.user_id if first else None
+        elif delta > 0 and record.first_blood is None:
+            record.first_blood = submission.user_id
+
+
 def judge_question(user_id, question_uid, race_id, result):
     try:
         result = result[-10:]
@@ -263,10 +304,14 @@ def judge_question(user_id, question_uid, race_id, result):
             is_passed = True
             update_user_heatmap(user_id, dt.now().strftime("%Y-%m-%d"))
 
-        add_question_record(user_id, question_uid, is_passed)
-        update_user_question_status(user_id, question_uid, is_passed, race_id=race_id)
         if race_id and race_id > 0:
+            # 提交记录与排行榜在同一事务中保存
+            submission = add_question_record(user_id, question_uid, is_passed, race_id=race_id, commit=False)
             update_race_rank(user_id, question_uid, is_passed, race_id)
+            keep_submission(submission)
+        else:
+            add_question_record(user_id, question_uid, is_passed)
+        update_user_question_status(user_id, question_uid, is_passed, race_id=race_id)
 
         return {
             "success": True,
@@ -7,7 +7,7 @@ from email.mime.text import MIMEText
 from flask import current_app as app
 from .turnstile_service import SMTP_CONFIG
 from .. import db
-from ..models import RaceData, QuestionsData, UserQuestionStatus, RaceRank, User
+from ..models import RaceData, QuestionsData, UserQuestionStatus, RaceRank, User, Submission
 from ..utils.validators import BusinessException, render_email_template
 
 
@@ -271,7 +271,7 @@ def update_race_rank(user_id, question_uid, is_passed, race_id):
         rank = RaceRank.query.filter_by(
             contest_id=race_id,
             user_id=user_id
-        ).first()
+        ).with_for_update().first()
 
         current_time = datetime.now()
 
@@ -367,6 +367,87 @@ def update_race_rank(user_id, question_uid, is_passed, race_id):
         }
 
 
+def get_race_problem_ids(race):
+    """比赛的题目ID列表（problems_list 可能以 JSON 字符串保存）"""
+    problems_list = race.problems_list or []
+    if isinstance(problems_list, str):
+        problems_list = json.loads(problems_list)
+    return [int(question_id) for question_id in problems_list]
+
+
+def _first_accepted(submissions, rejudged, passed):
+    """提交列表中第一次通过的下标（rejudged 这条提交按 passed 计算），没有通过时返回 None"""
+    for i, submission in enumerate(submissions):
+        if (passed if submission.uid == rejudged.uid else submission.is_passed):
+            return i
+    return None
+
+
+def rejudge_race_rank(submission, old_passed):
+    """
+    重测改变了比赛提交是否通过时修正该用户该题的排行榜记录（不提交事务），规则与 update_race_rank 相同
+    比赛提交与排行榜在同一事务中保存，因此已保存的提交都已计入 submit_count，
+    两者之差是更早的、没有保存的提交：其中已有通过时重测不影响该题，否则都按错误提交计入罚时
+    :param old_passed: 重测前是否通过
+    """
+    race = RaceData.query.get(submission.race_id)
+    if not race:
+        return
+    ALPHABET = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    problem_ids = get_race_problem_ids(race)
+    if submission.question_id not in problem_ids or problem_ids.index(submission.question_id) >= len(ALPHABET):
+        return
+    problem_key = ALPHABET[problem_ids.index(submission.question_id)]
+
+    rank = RaceRank.query.filter_by(
+        contest_id=submission.race_id,
+        user_id=submission.user_id
+    ).with_for_update().first()
+    if not rank:
+        return
+    problem_stats = json.loads(rank.problem_stats) if isinstance(rank.problem_stats, str) else rank.problem_stats
+    stats = (problem_stats or {}).get(problem_key)
+    if not stats:
+        return
+
+    submissions = Submission.query.filter_by(
+        user_id=submission.user_id,
+        question_id=submission.question_id,
+        race_id=submission.race_id
+    ).order_by(Submission.created_at, Submission.uid).all()
+    unsaved = stats["submit_count"] - len(submissions)
+    if unsaved < 0:
+        return
+
+    old_first = _first_accepted(submissions, submission, old_passed)
+    new_first = _first_accepted(submissions, submission, submission.is_passed)
+    if old_first == new_first:
+        return
+    # 有未保存的提交时，判断原来的首次通过是否就发生在其中（此时重测不影响该题）：
+    # first_solve_time 是 update_race_rank 取的当前时间（精确到秒），对应提交的 created_at 在同一事务中取得，
+    # 两者相差不到 1 秒，因此容差取 2 秒；早于已保存的第一次通过超过 2 秒的，视为未保存提交中的通过。
+    # 未保存的通过与已保存的第一次通过相隔不到 2 秒时会被当作后者，这种情况下按已保存的提交修正
+    if unsaved and stats["solved"] and (old_first is None or datetime.strptime(
+            stats["first_solve_time"], "%Y-%m-%d %H:%M:%S") < submissions[old_first].created_at - timedelta(seconds=2)):
+        return
+
+    if new_first is None:
+        stats.update({"solved": False, "penalty_time": 0, "first_solve_time": None})
+    else:
+        solve_time = submissions[new_first].created_at
+        time_diff = (solve_time - race.start_time).total_seconds() / 60
+        stats.update({
+            "solved": True,
+            "penalty_time": round(time_diff + (unsaved + new_first) * 20, 2),
+            "first_solve_time": solve_time.strftime("%Y-%m-%d %H:%M:%S")
+        })
+
+    solved = [s for s in problem_stats.values() if s["solved"]]
+    rank.problem_stats = json.dumps(problem_stats, ensure_ascii=False, separators=(',', ':'))
+    rank.total_solved = len(solved)
+    rank.total_penalty = sum(s["penalty_time"] for s in solved)
+
+
 def validate_race_access(user_id, race_id):
     """
     验证用户是否有权限使用该比赛的AI评判功能
@@ -399,16 +480,22 @@ def validate_race_access(user_id, race_id):
 
 
 def update_race_status():
-    """比赛状态更新"""
+    """
+    比赛状态更新
+    :return: 本次变为进行中的比赛ID列表
+    """
     try:
         now = datetime.now()
 
         # 1. 更新进行中的比赛
-        RaceData.query.filter(
+        started_query = RaceData.query.filter(
             RaceData.start_time <= now,
             RaceData.end_time > now,
             RaceData.status != 'running'
-        ).update({'status': 'running'})
+        )
+        started = [race.uid for race in started_query.all()]
+        if started:
+            RaceData.query.filter(RaceData.uid.in_(started)).update({'status': 'running'})
 
         # 2. 更新已结束的比赛
         RaceData.query.filter(
@@ -417,7 +504,45 @@ def update_race_status():
         ).update({'status': 'ended'})
 
         db.session.commit()
-        return True
+        return started
+    except Exception as e:
+        db.session.rollback()
+        raise e
+
+
+def prime_race_question_stats(race_id):
+    """
+    比赛开始时预先创建各题的全局统计记录（user_id=0），避免开赛后大量首次提交同时插入新记录
+    预建的记录与第一次提交创建的记录一致（首次通过时改为已通过），提交数、解决数为 0、没有一血，
+    开赛后显示的数据不变；排行榜记录仍由第一次提交创建，未提交的用户不出现在排行榜上
+    :param race_id: 比赛ID
+    :return: 新建的全局统计记录数
+    """
+    race = RaceData.query.get(race_id)
+    if not race:
+        return 0
+
+    try:
+        existing_stats = {s.question_id for s in UserQuestionStatus.query.filter(
+            UserQuestionStatus.user_id == 0,
+            UserQuestionStatus.race_id == race_id
+        ).all()}
+        new_stats = [
+            UserQuestionStatus(
+                race_id=race_id,
+                user_id=0,
+                question_id=question_id,
+                state='未通过',
+                submit=0,
+                solve=0,
+                first_blood=None
+            )
+            for question_id in get_race_problem_ids(race) if question_id not in existing_stats
+        ]
+
+        db.session.add_all(new_stats)
+        db.session.commit()
+        return len(new_stats)
     except Exception as e:
         db.session.rollback()
         raise e
@@ -0,0 +1,97 @@
+import time
+import uuid
+
+from config import Config
+from .. import redis_wrapper
+
+# 重测任务的进度保存在 judge:rejudge:<任务ID>
+REJUDGE_KEY = 'judge:rejudge:{}'
+
+
+def create_rejudge_job(question_id=None, race_id=None):
+    """
+    创建重测任务（只记录范围和进度，提交由判题队列分发）
+    :param question_id: 重测某道题的全部提交
+    :param race_id: 重测某场比赛的全部提交
+    :return: 任务ID
+    """
+    job_id = uuid.uuid4().hex
+    key = REJUDGE_KEY.format(job_id)
+    redis_wrapper.hset(key, mapping={
+        'question_id': question_id if question_id is not None else '',
+        'race_id': race_id if race_id is not None else '',
+        'state': 'pending',
+        'total': 0,
+        'done': 0,
+        'changed': 0,
+        'failed': 0,
+        'created_at': int(time.time())
+    })
+    redis_wrapper.expire(key, Config.JUDGE_REJUDGE_TTL)
+    return job_id
+
+
+def get_rejudge_scope(job_id):
+    """
+    :return: (question_id, race_id)，未指定的一项为 None；任务不存在时返回 None
+    """
+    job = redis_wrapper.hgetall(REJUDGE_KEY.format(job_id))
+    if not job:
+        return None
+    return (int(job['question_id']) if job['question_id'] else None,
+            int(job['race_id']) if job['race_id'] else None)
+
+
+def start_rejudge_job(job_id, total):
+    """记录需要重测的提交数，开始判题"""
+    redis_wrapper.hset(REJUDGE_KEY.format(job_id), mapping={'state': 'judging', 'total': total})
+
+
+def finish_rejudge_submission(job_id, changed=False, failed=False):
+    """
+    记录一条提交重测完成，最后一条完成时任务结束
+    :return: 是否为最后一条
+    """
+    key = REJUDGE_KEY.format(job_id)
+    pipe = redis_wrapper.pipeline()
+    if changed:
+        pipe.hincrby(key, 'changed', 1)
+    if failed:
+        pipe.hincrby(key, 'failed', 1)
+    pipe.hincrby(key, 'done', 1)
+    pipe.hget(key, 'total')
+    *_, done, total = pipe.execute()
+    if done != int(total):
+        return False
+    finish_rejudge_job(job_id)
+    return True
+
+
+def finish_rejudge_job(job_id):
+    redis_wrapper.hset(REJUDGE_KEY.format(job_id), mapping={'state': 'finished', 'finished_at': int(time.time())})
+
+
+def fail_rejudge_job(job_id, message):
+    redis_wrapper.hset(REJUDGE_KEY.format(job_id), mapping={'state': 'failed', 'message': message})
+
+
+def get_rejudge_progress(job_id):
+    """
+    查询重测进度
+    :return: 进度字典（state: pending/judging/finished/failed），任务不存在时返回 None
+    """
+    job = redis_wrapper.hgetall(REJUDGE_KEY.format(job_id))
+    if not job:
+        return None
+    progress = {
+        'job_id': job_id,
+        'question_id': int(job['question_id']) if job['question_id'] else None,
+        'race_id': int(job['race_id']) if job['race_id'] else None,
+        'state': job['state'],
+        'message': job.get('message')
+    }
+    for field in ('total', 'done', 'changed', 'failed', 'created_at', 'finished_at'):
+        progress[field] = int(job[field]) if job.get(field) else 0
+    progress['percent'] = round(progress['done'] * 100 / progress['total'], 1) if progress['total'] else (
+        100.0 if progress['state'] == 'finished' else 0.0)
+    return progress
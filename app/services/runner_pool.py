@@ -0,0 +1,170 @@
+import os
+import queue
+import signal
+import socket
+import subprocess
+import sys
+import threading
+
+from config import Config
+from .compile_service import get_runner_path
+
+
+class RunnerError(Exception):
+    """常驻运行器没有按协议回复（运行器崩溃或命令无效）"""
+
+
+class _Helper:
+    """一个常驻运行器进程（runner --serve），同一时间只运行一个选手程序"""
+
+    def __init__(self, runner):
+        parent_sock, child_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        try:
+            self.process = subprocess.Popen(
+                [runner, '--serve', str(child_sock.fileno())],
+                pass_fds=(child_sock.fileno(),),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL
+            )
+        except Exception:
+            parent_sock.close()
+            raise
+        finally:
+            child_sock.close()
+        self.sock = parent_sock
+
+    def alive(self):
+        return self.sock is not None and self.process.poll() is None
+
+    def request(self, command, fds):
+        socket.send_fds(self.sock, [command.encode('utf-8')], fds)
+        return self.receive()
+
+    def receive(self):
+        reply = self.sock.recv(256).split()
+        if not reply or reply[0] == b'error':
+            raise RunnerError(b' '.join(reply[1:]).decode('utf-8', errors='replace') or '运行器已退出')
+        return reply
+
+    def close(self):
+        """关闭套接字，运行器读到 EOF 后自行退出"""
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        try:
+            self.process.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+class PooledProcess:
+    """
+    由常驻运行器启动的选手程序，提供判题需要的 Popen 子集（pid、stdout、poll）
+    选手程序是新会话的首进程，结束时直接向整个进程组发送 SIGKILL
+    """
+
+    def __init__(self, pool, helper, pid):
+        self._pool = pool
+        self._helper = helper
+        self._lock = threading.Lock()
+        self.pid = pid
+        self.stdout = None
+        self.returncode = None
+        self.timed_out = False
+
+    def poll(self):
+        return self.returncode
+
+    def kill(self):
+        with self._lock:
+            if self.returncode is not None or self._helper is None:
+                return
+            try:
+                os.killpg(self.pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+
+    def wait(self):
+        """
+        等待运行器回收选手程序，归还运行器
+        :return: (wait 状态, 峰值内存KB, 用户态CPU微秒, 内核态CPU微秒)
+        """
+        if self._helper is None:
+            raise RunnerError('运行器已归还')
+        helper, self._helper = self._helper, None
+        try:
+            _, status, max_rss, user_us, system_us, timed_out = helper.receive()
+        except Exception:
+            self._pool.release(helper, broken=True)
+            raise
+        with self._lock:
+            self.returncode = os.waitstatus_to_exitcode(int(status))
+        self.timed_out = timed_out == b'1'
+        self._pool.release(helper)
+        return int(status), int(max_rss), int(user_us), int(system_us)
+
+    def abandon(self):
+        """判题出错时结束选手程序并回收运行器"""
+        self.kill()
+        try:
+            self.wait()
+        except Exception:
+            pass
+
+
+class RunnerPool:
+    """
+    常驻运行器池：每个核一个运行器进程，选手程序由运行器 fork/exec/回收，
+    判题进程只通过套接字传递描述符和限制，不再为每个测试点 fork 自身
+    """
+
+    def __init__(self, runner, size):
+        self._runner = runner
+        self._idle = queue.LifoQueue()
+        for _ in range(size):
+            self._idle.put(_Helper(runner))
+
+    def release(self, helper, broken=False):
+        if broken:
+            helper.close()
+        self._idle.put(helper)
+
+    def spawn(self, command, cpu_seconds, address_space, wall_ms, stdin, stdout, stderr):
+        """
+        在空闲的运行器中启动选手程序（没有空闲运行器时等待）
+        :param stdin/stdout/stderr: 选手程序使用的文件描述符
+        :return: PooledProcess
+        """
+        helper = self._idle.get()
+        try:
+            if not helper.alive():
+                helper.close()
+                helper = _Helper(self._runner)
+            reply = helper.request(f"{cpu_seconds} {address_space} {wall_ms} {command}\n", [stdin, stdout, stderr])
+            return PooledProcess(self, helper, int(reply[1]))
+        except Exception:
+            self.release(helper, broken=True)
+            raise
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_runner_pool():
+    """
+    获取当前进程的常驻运行器池（首次调用时启动，大小为 JUDGE_MAX_WORKERS）
+    :return: RunnerPool；未启用、非 Linux 或运行器不可用时返回 None
+    """
+    global _pool
+    if not Config.JUDGE_RUNNER_POOL or not sys.platform.startswith('linux'):
+        return None
+
+    with _pool_lock:
+        if _pool is None:
+            runner = get_runner_path()
+            if not runner:
+                return None
+            _pool = RunnerPool(runner, Config.JUDGE_MAX_WORKERS)
+        return _pool
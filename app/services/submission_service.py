@@ -0,0 +1,178 @@
+import hashlib
+from datetime import datetime
+
+from sqlalchemy import func
+
+from .. import db
+from ..models import Submission, User
+from ..utils.judge_utils import normalize_source
+
+
+def source_hash(code):
+    """规范化源码（去掉行尾空白和多余空行）的 sha256，源码为空时返回 None"""
+    if code is None:
+        return None
+    return hashlib.sha256(normalize_source(code).encode('utf-8')).hexdigest()
+
+
+def _result_fields(result):
+    """从判题结果中取出提交记录保存的字段：结果、是否通过、得分、最长运行时间和最大内存"""
+    details = result.get('details') or []
+    times = [d['execution_time'] for d in details if d.get('execution_time') is not None]
+    memories = [d['memory_used'] for d in details if d.get('memory_used') is not None]
+    return {
+        'status': result['status'],
+        'is_passed': result['status'] == 'Accepted',
+        'score': result.get('score'),
+        'time_used': max(times) if times else None,
+        'memory_used': max(memories) if memories else None
+    }
+
+
+def save_submission(user_id, question_id, code, language, result, race_id=0, commit=True):
+    """
+    追加一条提交记录
+    :param code: 源码，AI 评判的提交为 None（不参与重测）
+    :param commit: 为 False 时只加入当前事务，由后续的更新（如比赛排行榜）一并提交
+    :return: 提交记录
+    """
+    try:
+        submission = Submission(
+            user_id=user_id,
+            question_id=question_id,
+            race_id=race_id or 0,
+            language=language,
+            code=code,
+            source_hash=source_hash(code),
+            **_result_fields(result)
+        )
+        db.session.add(submission)
+        if commit:
+            db.session.commit()
+        return submission
+    except Exception as e:
+        db.session.rollback()
+        raise e
+
+
+def keep_submission(submission):
+    """未提交的提交记录随其他更新回滚时（如排行榜更新失败）重新单独保存"""
+    if submission in db.session:
+        return
+    try:
+        db.session.add(submission)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        raise e
+
+
+def update_submission_result(submission, result):
+    """重测后更新提交记录的判题结果（不提交事务，由调用方与题目状态、排行榜的修正一并提交）"""
+    for field, value in _result_fields(result).items():
+        setattr(submission, field, value)
+
+
+def get_submission_ids(question_id=None, race_id=None):
+    """
+    获取某道题或某场比赛中可以重测（保存了源码）的全部提交ID（按提交顺序）
+    :return: 提交ID列表
+    """
+    query = db.session.query(Submission.uid).filter(Submission.code.isnot(None))
+    if question_id is not None:
+        query = query.filter(Submission.question_id == question_id)
+    if race_id is not None:
+        query = query.filter(Submission.race_id == race_id)
+    return [uid for uid, in query.order_by(Submission.uid).all()]
+
+
+def count_user_questions(user_id):
+    """用户提交过的题目数"""
+    return db.session.query(func.count(func.distinct(Submission.question_id))) \
+        .filter(Submission.user_id == user_id).scalar() or 0
+
+
+def get_user_question_records(user_ids, limit=None):
+    """
+    按题目汇总用户的做题记录（每道题一条，最近提交的在前）
+    :param user_ids: 用户ID列表
+    :param limit: 每个用户最多返回的题目数，None 表示全部
+    :return: {用户ID: [{"question_uid", "submit_time", "is_passed", "best_score"}, ...]}，
+             submit_time 为最近一次提交时间，is_passed 表示是否通过过
+    """
+    records = {user_id: [] for user_id in user_ids}
+    if not user_ids:
+        return records
+
+    last_submit = func.max(Submission.created_at)
+    query = db.session.query(
+        Submission.user_id,
+        Submission.question_id,
+        last_submit,
+        func.max(Submission.is_passed),
+        func.max(Submission.score)
+    ).filter(Submission.user_id.in_(user_ids)) \
+        .group_by(Submission.user_id, Submission.question_id) \
+        .order_by(Submission.user_id, last_submit.desc())
+    if limit is not None and len(user_ids) == 1:
+        # 单个用户（个人主页）时在 SQL 中只取最近的 limit 道题，读取量不随做题历史增长
+        query = query.limit(limit)
+    rows = query.all()
+
+    for user_id, question_id, submit_time, is_passed, best_score in rows:
+        user_records = records[user_id]
+        if limit is not None and len(user_records) >= limit:
+            continue
+        user_records.append({
+            "question_uid": str(question_id),
+            "submit_time": submit_time.strftime("%Y-%m-%d %H:%M:%S"),
+            "is_passed": bool(is_passed),
+            "best_score": best_score
+        })
+    return records
+
+
+def migrate_question_records(batch_size=500):
+    """
+    把 User.questions 中的做题记录迁移为提交记录（每道题一条，保留最近提交时间、是否通过和最高得分）
+    已迁移的记录（同一用户、题目和提交时间）不会重复写入，可以重复执行；User.questions 保持不变
+    :return: 写入的提交记录数
+    """
+    migrated = 0
+    last_uid = 0
+    while True:
+        users = User.query.filter(User.uid > last_uid).order_by(User.uid).limit(batch_size).all()
+        if not users:
+            return migrated
+        last_uid = users[-1].uid
+
+        try:
+            for user in users:
+                if not user.questions:
+                    continue
+                existing = set(db.session.query(Submission.question_id, Submission.created_at).filter(
+                    Submission.user_id == user.uid,
+                    Submission.race_id == 0,
+                    Submission.code.is_(None)
+                ).all())
+                for record in user.questions:
+                    question_id = int(record["question_uid"])
+                    submit_time = datetime.strptime(record["submit_time"], "%Y-%m-%d %H:%M:%S")
+                    if (question_id, submit_time) in existing:
+                        continue
+                    is_passed = bool(record.get("is_passed"))
+                    db.session.add(Submission(
+                        user_id=user.uid,
+                        question_id=question_id,
+                        race_id=0,
+                        status='Accepted' if is_passed else 'Wrong Answer',
+                        is_passed=is_passed,
+                        score=record.get("best_score", record.get("score")),
+                        created_at=submit_time
+                    ))
+                    existing.add((question_id, submit_time))
+                    migrated += 1
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            raise e
@@ -1,5 +1,53 @@
+import hashlib
+import io
+import json
 import os
 import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from config import Config
+from .. import redis_wrapper
+from .compile_service import compile_cpp
+from ..utils.judge_utils import normalized_lines, output_digest
+
+# 测试用例清单文件名，位于每道题的测试用例目录下
+MANIFEST_FILE = 'manifest.json'
+# 清单格式版本，旧格式的清单在加载时重新生成
+MANIFEST_FORMAT = 3
+# 特殊判题程序（checker）源码文件名，位于测试用例目录下
+CHECKER_FILE = 'checker.cpp'
+
+# 已加载的清单缓存：测试用例目录 -> (清单文件修改时间, 清单)
+_manifest_cache = {}
+_manifest_lock = threading.Lock()
+
+# 测试数据内存缓存：(文件路径, 测试数据版本) -> 文件内容，按最近最少使用淘汰
+_data_cache = OrderedDict()
+_data_cache_lock = threading.Lock()
+_data_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'resident_bytes': 0}
+
+# 多节点判题：题目当前的测试数据版本保存在 judge:testdata:<题目ID>，
+# 该版本的测试数据压缩包保存在 judge:testdata:<题目ID>:<版本>，判题节点按版本拉取，
+# 安装到 testcases_<题目ID>@<版本> 快照目录后判题
+TESTDATA_VERSION_KEY = 'judge:testdata:{}'
+TESTDATA_ARCHIVE_KEY = 'judge:testdata:{}:{}'
+
+# 拉取测试数据时按题目加锁，同一进程内只拉取一次
+_sync_locks = {}
+_sync_locks_lock = threading.Lock()
+
+# 本进程最近一次为测试数据压缩包续期的时间：题目ID -> (版本, time.monotonic())
+_testdata_refreshed = {}
 
 
 def process_test_cases(testcase_dir):
@@ -39,6 +87,7 @@ def process_test_cases(testcase_dir):
 
     return result
 
+
 def move_test_cases(testcase_dir, target_dir):
     """
     将处理后的测试用例移动到目标目录
@@ -52,4 +101,394 @@ def move_test_cases(testcase_dir, target_dir):
             target_path = os.path.join(target_dir, testcase_id)
             if os.path.exists(target_path):  # 如果目标目录已存在，先删除
                 shutil.rmtree(target_path)
-            shutil.move(testcase_path, target_path)
\ No newline at end of file
+            shutil.move(testcase_path, target_path)
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build_manifest(testcase_dir):
+    """
+    扫描测试用例目录，生成清单（测试点顺序、文件大小和哈希）
+    规则与判题一致：测试点目录按数字排序，每个 .in 文件需有同名 .out 文件
+    """
+    case_dirs = [d for d in os.listdir(testcase_dir)
+                 if os.path.isdir(os.path.join(testcase_dir, d)) and d.isdigit()]
+
+    cases = []
+    for case_dir in sorted(case_dirs, key=lambda x: int(x)):
+        case_path = os.path.join(testcase_dir, case_dir)
+        for input_file in sorted(f for f in os.listdir(case_path) if f.endswith('.in')):
+            base_name = input_file[:-3]
+            output_file = base_name + '.out'
+            if not os.path.exists(os.path.join(case_path, output_file)):
+                continue
+
+            input_path = os.path.join(case_path, input_file)
+            output_path = os.path.join(case_path, output_file)
+
+            # 预期输出只在上传时规范化一次，判题时对选手输出做同样的规范化后比较摘要
+            with open(output_path, 'rb') as f:
+                normalized_digest, normalized_size = output_digest(normalized_lines(f))
+
+            cases.append({
+                'case_id': f"{case_dir}_{base_name}",
+                'input': f"{case_dir}/{input_file}",
+                'output': f"{case_dir}/{output_file}",
+                'input_size': os.path.getsize(input_path),
+                'output_size': os.path.getsize(output_path),
+                'input_sha256': _file_sha256(input_path),
+                'output_sha256': _file_sha256(output_path),
+                'output_digest': normalized_digest,
+                'output_normalized_size': normalized_size
+            })
+
+    checker = None
+    checker_path = os.path.join(testcase_dir, CHECKER_FILE)
+    if os.path.exists(checker_path):
+        checker = {'source': CHECKER_FILE, 'sha256': _file_sha256(checker_path)}
+
+    # 测试数据版本：由全部测试点和 checker 的内容哈希决定，数据不变则版本不变
+    version = hashlib.sha256(json.dumps({'cases': cases, 'checker': checker}, sort_keys=True)
+                             .encode('utf-8')).hexdigest()[:16]
+    return {'format': MANIFEST_FORMAT, 'version': version, 'cases': cases, 'checker': checker}
+
+
+def write_manifest(testcase_dir):
+    """生成清单并原子地写入测试用例目录"""
+    manifest = build_manifest(testcase_dir)
+    manifest_path = os.path.join(testcase_dir, MANIFEST_FILE)
+    tmp_path = f"{manifest_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, manifest_path)
+    return manifest
+
+
+def install_checker(testcase_dir, code):
+    """
+    编译并保存特殊判题程序，然后更新清单
+    编译结果按源码哈希进入编译缓存，判题时直接命中，不再重新编译
+    :return: (清单, 编译错误信息)，编译失败时不保存源码，清单为 None
+    """
+    executable, compile_error = compile_cpp(code)
+    if compile_error is not None or not executable:
+        return None, compile_error or '可执行文件未生成'
+
+    os.makedirs(testcase_dir, exist_ok=True)
+    checker_path = os.path.join(testcase_dir, CHECKER_FILE)
+    tmp_path = f"{checker_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(code)
+    os.replace(tmp_path, checker_path)
+    return write_manifest(testcase_dir), None
+
+
+def remove_checker(testcase_dir):
+    """删除特殊判题程序，恢复逐行比较，返回更新后的清单"""
+    try:
+        os.remove(os.path.join(testcase_dir, CHECKER_FILE))
+    except FileNotFoundError:
+        pass
+    return write_manifest(testcase_dir)
+
+
+def load_manifest(testcase_dir):
+    """
+    读取测试用例清单（进程内缓存，清单文件修改后自动重新加载）
+    旧数据没有清单时自动生成
+    :return: 清单字典，测试点的 input/output 已转换为绝对路径
+    """
+    manifest_path = os.path.join(testcase_dir, MANIFEST_FILE)
+    try:
+        mtime = os.stat(manifest_path).st_mtime_ns
+    except FileNotFoundError:
+        write_manifest(testcase_dir)
+        mtime = os.stat(manifest_path).st_mtime_ns
+
+    cached = _manifest_cache.get(testcase_dir)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    with _manifest_lock:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('format') != MANIFEST_FORMAT:
+            manifest = write_manifest(testcase_dir)
+            mtime = os.stat(manifest_path).st_mtime_ns
+        for case in manifest['cases']:
+            case['input'] = os.path.join(testcase_dir, case['input'])
+            case['output'] = os.path.join(testcase_dir, case['output'])
+            case['version'] = manifest['version']
+        if manifest.get('checker'):
+            manifest['checker']['source'] = os.path.join(testcase_dir, manifest['checker']['source'])
+        _manifest_cache[testcase_dir] = (mtime, manifest)
+        return manifest
+
+
+def read_case_file(path, version, size, max_entry_bytes=None):
+    """
+    读取测试数据文件，命中内存缓存时不访问磁盘
+    :param path: 文件路径
+    :param version: 测试数据版本（清单中的 version），重新上传后旧版本的缓存不再命中
+    :param size: 文件大小（清单中记录的大小）
+    :param max_entry_bytes: 可缓存的文件大小上限，默认为 JUDGE_TESTCASE_CACHE_MAX_ENTRY_BYTES
+    :return: 文件内容；超过上限的文件不缓存，返回 None
+    """
+    if max_entry_bytes is None:
+        max_entry_bytes = Config.JUDGE_TESTCASE_CACHE_MAX_ENTRY_BYTES
+    if size > min(max_entry_bytes, Config.JUDGE_TESTCASE_CACHE_MAX_BYTES):
+        return None
+
+    key = (path, version)
+    with _data_cache_lock:
+        data = _data_cache.get(key)
+        if data is not None:
+            _data_cache.move_to_end(key)
+            _data_cache_stats['hits'] += 1
+            return data
+        _data_cache_stats['misses'] += 1
+
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    with _data_cache_lock:
+        if key not in _data_cache:
+            _data_cache[key] = data
+            _data_cache_stats['resident_bytes'] += len(data)
+        while _data_cache_stats['resident_bytes'] > Config.JUDGE_TESTCASE_CACHE_MAX_BYTES:
+            _, evicted = _data_cache.popitem(last=False)
+            _data_cache_stats['resident_bytes'] -= len(evicted)
+            _data_cache_stats['evictions'] += 1
+    return data
+
+
+def get_case_cache_stats():
+    """当前进程测试数据缓存的统计：命中率、常驻字节数等"""
+    with _data_cache_lock:
+        stats = dict(_data_cache_stats)
+        stats['entries'] = len(_data_cache)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+    stats['max_bytes'] = Config.JUDGE_TESTCASE_CACHE_MAX_BYTES
+    return stats
+
+
+def _testcase_dir(question_id):
+    return os.path.join(Config.TESTCASE_DIR, f"testcases_{question_id}")
+
+
+def _snapshot_dir(question_id, version):
+    """判题使用的测试数据快照目录：每个版本一个目录，安装后不再修改"""
+    return os.path.join(Config.TESTCASE_DIR, f"testcases_{question_id}@{version}")
+
+
+def _snapshot_lock_path(snapshot_dir):
+    return os.path.join(os.path.dirname(snapshot_dir), f".{os.path.basename(snapshot_dir)}.lock")
+
+
+def _snapshot_ready(snapshot_dir):
+    # 快照目录整体改名就位，清单存在即安装完成
+    return os.path.isfile(os.path.join(snapshot_dir, MANIFEST_FILE))
+
+
+def _archive_testdata(testcase_dir):
+    """把测试用例目录（测试点、清单和 checker 源码）打包为 zip"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for root, _, files in os.walk(testcase_dir):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                archive.write(path, os.path.relpath(path, testcase_dir))
+    return buffer.getvalue()
+
+
+def publish_testdata(question_id, manifest=None):
+    """
+    把本机的测试数据按版本发布到 Redis，其他判题节点判题前按版本拉取
+    当前版本的压缩包保留 JUDGE_TESTDATA_TTL 秒（判题节点使用时续期），旧版本保留 JUDGE_TESTDATA_STALE_TTL 秒后过期
+    :param manifest: 刚写入的清单，省略时读取测试用例目录下的清单
+    :return: 发布的版本
+    """
+    testcase_dir = _testcase_dir(question_id)
+    version = (manifest or load_manifest(testcase_dir))['version']
+    archive_key = TESTDATA_ARCHIVE_KEY.format(question_id, version)
+
+    previous = redis_wrapper.get(TESTDATA_VERSION_KEY.format(question_id))
+    if previous == version and redis_wrapper.binary.expire(archive_key, Config.JUDGE_TESTDATA_TTL):
+        return version
+
+    redis_wrapper.binary.set(archive_key, _archive_testdata(testcase_dir), ex=Config.JUDGE_TESTDATA_TTL)
+    redis_wrapper.set(TESTDATA_VERSION_KEY.format(question_id), version)
+    if previous and previous != version:
+        redis_wrapper.expire(TESTDATA_ARCHIVE_KEY.format(question_id, previous), Config.JUDGE_TESTDATA_STALE_TTL)
+    return version
+
+
+def get_testdata_version(question_id):
+    """题目已发布的测试数据版本，未发布时返回 None"""
+    return redis_wrapper.get(TESTDATA_VERSION_KEY.format(question_id))
+
+
+def testdata_exists(question_id):
+    """题目是否有测试数据（已发布到 Redis，或在本机上）"""
+    return get_testdata_version(question_id) is not None or os.path.isdir(_testcase_dir(question_id))
+
+
+def _local_version(testcase_dir):
+    if not os.path.isdir(testcase_dir):
+        return None
+    return load_manifest(testcase_dir)['version']
+
+
+def _install_testdata(snapshot_dir, data):
+    """把测试数据压缩包解压到同一文件系统的临时目录，再整体改名为该版本的快照目录"""
+    os.makedirs(Config.TESTCASE_DIR, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix='sync_', dir=Config.TESTCASE_DIR)
+    try:
+        staged_dir = os.path.join(work_dir, 'data')
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            archive.extractall(staged_dir)
+        os.rename(staged_dir, snapshot_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _list_snapshots(question_id):
+    """本机上该题的全部快照目录：[(版本, 目录)]"""
+    prefix = f"testcases_{question_id}@"
+    try:
+        names = os.listdir(Config.TESTCASE_DIR)
+    except FileNotFoundError:
+        return []
+    return [(name[len(prefix):], os.path.join(Config.TESTCASE_DIR, name))
+            for name in names if name.startswith(prefix)]
+
+
+def _remove_stale_snapshots(question_id, version):
+    """
+    删除该题旧版本的快照目录；正在判题的进程持有快照的共享锁，拿不到排他锁的快照跳过，下次再清理
+    没有 fcntl（Windows）时无法判断是否仍在使用，旧快照保留
+    """
+    if fcntl is None:
+        return
+    for snapshot_version, snapshot_dir in _list_snapshots(question_id):
+        if snapshot_version == version:
+            continue
+        lock_path = _snapshot_lock_path(snapshot_dir)
+        with open(lock_path, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            shutil.rmtree(snapshot_dir, ignore_errors=True)
+            try:
+                os.remove(lock_path)
+            except FileNotFoundError:
+                pass
+        with _manifest_lock:
+            _manifest_cache.pop(snapshot_dir, None)
+
+
+def _latest_snapshot(question_id):
+    """本机最近安装的快照目录，没有时返回 None"""
+    snapshots = [d for _, d in _list_snapshots(question_id) if _snapshot_ready(d)]
+    return max(snapshots, key=os.path.getmtime) if snapshots else None
+
+
+def _sync_lock(question_id):
+    with _sync_locks_lock:
+        return _sync_locks.setdefault(question_id, threading.Lock())
+
+
+@contextmanager
+def _question_file_lock(question_id):
+    """线程锁防止同一进程重复拉取；文件锁防止同一节点的多个 worker 进程同时安装或清理快照"""
+    with _sync_lock(question_id):
+        os.makedirs(Config.TESTCASE_DIR, exist_ok=True)
+        with open(os.path.join(Config.TESTCASE_DIR, f".testcases_{question_id}.lock"), 'w') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+
+def _refresh_testdata(question_id, version, snapshot_dir):
+    """
+    本机使用某个版本时定期为 Redis 中的压缩包续期，压缩包已过期时用本机快照重新发布，并顺带清理旧快照
+    同一进程每 JUDGE_TESTDATA_REFRESH_INTERVAL 秒最多执行一次
+    """
+    now = time.monotonic()
+    refreshed = _testdata_refreshed.get(question_id)
+    if refreshed and refreshed[0] == version and now - refreshed[1] < Config.JUDGE_TESTDATA_REFRESH_INTERVAL:
+        return
+    _testdata_refreshed[question_id] = (version, now)
+
+    archive_key = TESTDATA_ARCHIVE_KEY.format(question_id, version)
+    if not redis_wrapper.binary.expire(archive_key, Config.JUDGE_TESTDATA_TTL):
+        redis_wrapper.binary.set(archive_key, _archive_testdata(snapshot_dir),
+                                 ex=Config.JUDGE_TESTDATA_TTL, nx=True)
+    with _question_file_lock(question_id):
+        _remove_stale_snapshots(question_id, version)
+
+
+def ensure_testdata(question_id):
+    """
+    确保本节点上有已发布的最新版本测试数据的快照，没有时从 Redis 拉取并安装到该版本的目录
+    已安装的快照不会被修改，旧版本的快照在不再使用后删除
+    尚未发布过的题目（旧数据）由持有测试数据的节点补发布
+    :return: 快照目录；本机和 Redis 中都没有测试数据时返回 None
+    """
+    version = get_testdata_version(question_id)
+    if version is None:
+        if not os.path.isdir(_testcase_dir(question_id)):
+            return None
+        version = publish_testdata(question_id)
+
+    snapshot_dir = _snapshot_dir(question_id, version)
+    if _snapshot_ready(snapshot_dir):
+        _refresh_testdata(question_id, version, snapshot_dir)
+        return snapshot_dir
+
+    with _question_file_lock(question_id):
+        if not _snapshot_ready(snapshot_dir):
+            archive_key = TESTDATA_ARCHIVE_KEY.format(question_id, version)
+            data = redis_wrapper.binary.get(archive_key)
+            if data is None and _local_version(_testcase_dir(question_id)) == version:
+                # 压缩包已过期或被清除，本机有该版本的原始数据时重新发布
+                publish_testdata(question_id)
+                data = redis_wrapper.binary.get(archive_key)
+            if data is None:
+                # 该版本的压缩包已不存在，使用本机最近安装的版本
+                return _latest_snapshot(question_id)
+            _install_testdata(snapshot_dir, data)
+            redis_wrapper.binary.expire(archive_key, Config.JUDGE_TESTDATA_TTL)
+        _remove_stale_snapshots(question_id, version)
+    _testdata_refreshed[question_id] = (version, time.monotonic())
+    return snapshot_dir
+
+
+@contextmanager
+def use_testdata(question_id):
+    """
+    取得本节点上最新版本测试数据的快照目录，使用期间持有该快照的共享锁，判题途中不会被清理
+    :return: 上下文管理器，产出快照目录；没有测试数据时产出 None
+    """
+    for _ in range(3):
+        snapshot_dir = ensure_testdata(question_id)
+        if snapshot_dir is None or fcntl is None:
+            yield snapshot_dir
+            return
+        with open(_snapshot_lock_path(snapshot_dir), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_SH)
+            # 加锁前快照可能刚被清理（版本已过时），重新确认后再使用
+            if _snapshot_ready(snapshot_dir):
+                yield snapshot_dir
+                return
+    yield None
@@ -7,6 +7,7 @@ from sqlalchemy import func
 
 from ..extensions import db
 from app.models import User, QuestionsData, RaceRank, RaceData
+from app.services.submission_service import count_user_questions, get_user_question_records
 from app.utils.validators import is_safe_filename
 from config import Config
 import os
@@ -103,7 +104,7 @@ def get_user_info(user_id):
         "username": user.username,
         "email": user.email,
         "description": user.description,
-        "questions_num": len(user.questions),
+        "questions_num": count_user_questions(user_id),
         "races_num": len(user.race),
         "create_time": user.create_time.strftime('%Y-%m-%d'),
         "rating": user.rating,
@@ -118,27 +119,20 @@ def get_user_questions(user_id, limit=10):
         user_id: 用户ID
         limit: 返回记录数（默认10条）
     """
-    # 1. 获取用户做题记录
-    user = User.query.get(user_id)
-    if not user or not user.questions:
+    # 1. 获取用户最近提交的题目（按题目汇总的提交记录）
+    user_records = get_user_question_records([user_id], limit=limit)[user_id]
+    if not user_records:
         return []
 
-    # 2. 提取最近的题目UID和时间
-    sorted_questions = sorted(
-        user.questions,
-        key=lambda x: x['submit_time'],
-        reverse=True
-    )[:limit]
-
-    # 3. 获取题目详细信息
-    question_uids = [q['question_uid'] for q in sorted_questions]
+    # 2. 获取题目详细信息
+    question_uids = [int(r['question_uid']) for r in user_records]
     questions_data = QuestionsData.query.filter(
         QuestionsData.uid.in_(question_uids)
     ).all()
 
-    # 4. 构建结果
+    # 3. 构建结果
     result = []
-    for user_record in sorted_questions:
+    for user_record in user_records:
         # 找到对应的题目详情
         detail = next(
             (qd for qd in questions_data
@@ -551,6 +545,9 @@ def get_user_list_service(uid=None, username=None, rating=None, page=1, per_page
     # 分页
     paginated_users = query.paginate(page=page, per_page=per_page)
 
+    # 当前页用户的做题记录（按题目汇总的提交记录）
+    question_records = get_user_question_records([user.uid for user in paginated_users.items])
+
     # 正确处理用户列表
     users = []
     for user in paginated_users.items:
@@ -560,7 +557,7 @@ def get_user_list_service(uid=None, username=None, rating=None, page=1, per_page
             'email': user.email,
             'description': user.description,
             'role': user.role,
-            'questions': user.questions,
+            'questions': question_records[user.uid],
             'race': user.race,
             'rating': user.rating,
             'is_banned': user.is_banned,
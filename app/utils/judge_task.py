@@ -0,0 +1,173 @@
+import time
+
+from celery.signals import worker_ready, worker_shutdown
+from celery.utils import worker_direct
+
+from app.extensions import celery
+from config import Config
+from .. import create_app
+from ..services.judge_metrics_service import publish_worker_metrics
+from ..services.judge_node_service import get_judge_nodes, mark_node_busy, start_heartbeat, stop_heartbeat
+from ..services.judge_queue_service import add_pending, judge_lane, remove_pending, submission_priority
+from ..services.judge_service import judge_submission, rejudge_submission, warmup_problems
+from ..services.rejudge_service import fail_rejudge_job, finish_rejudge_job, finish_rejudge_submission, \
+    get_rejudge_scope, start_rejudge_job
+from ..services.submission_service import get_submission_ids
+
+# 每个 worker 进程只创建一次应用，避免每次判题都重新初始化
+_app = None
+
+
+def _get_app():
+    global _app
+    if _app is None:
+        _app = create_app()
+    return _app
+
+
+def _is_judge_worker(worker):
+    """worker 是否消费判题队列（即判题节点）"""
+    return Config.JUDGE_QUEUE in worker.app.amqp.queues.consume_from
+
+
+@worker_ready.connect
+def start_judge_node(sender, **kwargs):
+    """判题节点就绪后开始上报心跳和容量"""
+    worker = sender.controller
+    if _is_judge_worker(worker):
+        _get_app()
+        start_heartbeat(worker.hostname, worker.concurrency)
+
+
+@worker_shutdown.connect
+def stop_judge_node(sender, **kwargs):
+    if _is_judge_worker(sender):
+        stop_heartbeat(sender.hostname)
+
+
+@celery.task(name='judge.submit', bind=True)
+def judge_submission_task(self, user_id, problem_id, code, language, race_id=0, submitted_at=None, lane=None):
+    app = _get_app()
+    with app.app_context():
+        node = self.request.hostname
+        try:
+            mark_node_busy(node, 1)
+            return judge_submission(user_id, problem_id, code, language, race_id=race_id,
+                                    submitted_at=submitted_at, lane=lane)
+        except Exception as e:
+            app.logger.error(f"判题任务失败: {str(e)}", exc_info=True)
+            return {"status": "System Error", "message": f"判题过程中出错: {str(e)}"}
+        finally:
+            try:
+                if lane:
+                    remove_pending(user_id)
+                mark_node_busy(node, -1)
+                publish_worker_metrics()
+            except Exception as e:
+                app.logger.warning(f"上报判题指标失败: {str(e)}")
+
+
+def enqueue_judge_submission(user_id, problem_id, code, language, race_id=0, lane=None):
+    """
+    把提交放入判题队列：按通道（比赛 > 练习 > 重测）和该用户尚未判完的提交数决定优先级
+    :param lane: 优先级通道，省略时按 race_id 判断比赛或练习
+    :return: celery AsyncResult
+    """
+    lane = lane or judge_lane(race_id)
+    priority = submission_priority(user_id, lane)
+    add_pending(user_id)
+    try:
+        return judge_submission_task.apply_async(
+            (user_id, problem_id, code, language, race_id),
+            {'submitted_at': time.time(), 'lane': lane},
+            priority=priority
+        )
+    except Exception:
+        remove_pending(user_id)
+        raise
+
+
+@celery.task(name='judge.warmup')
+def warmup_judge_task(problem_ids):
+    """比赛开始时预热判题 worker 的测试数据缓存"""
+    app = _get_app()
+    with app.app_context():
+        try:
+            return {'success': True, 'problems': warmup_problems(problem_ids)}
+        except Exception as e:
+            app.logger.error(f"判题预热失败: {str(e)}", exc_info=True)
+            return {'success': False, 'message': str(e)}
+        finally:
+            try:
+                publish_worker_metrics()
+            except Exception as e:
+                app.logger.warning(f"上报判题指标失败: {str(e)}")
+
+
+def warmup_judge_nodes(problem_ids):
+    """
+    向每个在线的判题节点（各自的专属队列）发送预热任务，所有节点都提前加载测试数据
+    没有节点上报心跳时退回到判题队列，由任意一个 worker 预热
+    :return: 发送的预热任务数
+    """
+    nodes = [node['node'] for node in get_judge_nodes()['nodes']]
+    if not nodes:
+        warmup_judge_task.delay(problem_ids)
+        return 1
+    for node in nodes:
+        warmup_judge_task.apply_async((problem_ids,), queue=worker_direct(node))
+    return len(nodes)
+
+
+def _rejudge_priority():
+    return Config.JUDGE_PRIORITY_LANES['rejudge']
+
+
+def start_rejudge(job_id):
+    """以重测通道的优先级分发重测任务"""
+    return rejudge_task.apply_async((job_id,), priority=_rejudge_priority())
+
+
+@celery.task(name='judge.rejudge')
+def rejudge_task(job_id):
+    """把重测范围内的全部提交逐条放入判题队列（重测通道，低于比赛和练习），由各判题节点并行判题"""
+    app = _get_app()
+    with app.app_context():
+        try:
+            question_id, race_id = get_rejudge_scope(job_id)
+            submission_ids = get_submission_ids(question_id=question_id, race_id=race_id)
+            start_rejudge_job(job_id, len(submission_ids))
+            if not submission_ids:
+                finish_rejudge_job(job_id)
+            for submission_id in submission_ids:
+                rejudge_submission_task.apply_async((job_id, submission_id), priority=_rejudge_priority())
+            return {'success': True, 'total': len(submission_ids)}
+        except Exception as e:
+            app.logger.error(f"分发重测任务失败: {str(e)}", exc_info=True)
+            fail_rejudge_job(job_id, str(e))
+            return {'success': False, 'message': str(e)}
+
+
+@celery.task(name='judge.rejudge_submission')
+def rejudge_submission_task(job_id, submission_id):
+    """重测一条提交，结果变化时按增量修正题目状态和排行榜"""
+    app = _get_app()
+    with app.app_context():
+        changed = failed = False
+        try:
+            statuses = rejudge_submission(submission_id)
+            if statuses is None or statuses[1] == 'System Error':
+                failed = True
+            else:
+                changed = statuses[0] != statuses[1]
+        except Exception as e:
+            app.logger.error(f"重测提交 {submission_id} 失败: {str(e)}", exc_info=True)
+            failed = True
+        finally:
+            try:
+                publish_worker_metrics()
+            except Exception as e:
+                app.logger.warning(f"上报判题指标失败: {str(e)}")
+
+        finish_rejudge_submission(job_id, changed=changed, failed=failed)
+        return {'submission_id': submission_id, 'changed': changed, 'failed': failed}
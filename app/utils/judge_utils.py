@@ -0,0 +1,70 @@
+import hashlib
+
+
+def split_lines(chunks):
+    """把字节块流切分成行（不含换行符）"""
+    pending = []
+    for chunk in chunks:
+        parts = chunk.split(b'\n')
+        pending.append(parts[0])
+        for part in parts[1:]:
+            yield b''.join(pending)
+            pending = [part]
+    if any(pending):
+        yield b''.join(pending)
+
+
+def normalized_lines(lines):
+    """
+    规范化输出行：每行去掉首尾空白，忽略开头和结尾的空行
+    与对整个输出 strip() 后再逐行 strip() 比较的规则一致
+    """
+    blank_lines = 0
+    started = False
+    for line in lines:
+        line = line.strip()
+        if not line:
+            if started:
+                blank_lines += 1
+            continue
+        for _ in range(blank_lines):
+            yield b''
+        blank_lines = 0
+        started = True
+        yield line
+
+
+def output_digest(lines, max_size=None):
+    """
+    计算规范化输出的摘要
+    :param lines: 规范化后的行
+    :param max_size: 字节数上限，超过时立即停止（不再消费剩余的行）
+    :return: (sha256 摘要, 规范化后的字节数)，超过上限时摘要为 None
+    """
+    digest = hashlib.sha256()
+    size = 0
+    for line in lines:
+        digest.update(line)
+        digest.update(b'\n')
+        size += len(line) + 1
+        if max_size is not None and size > max_size:
+            return None, size
+    return digest.hexdigest(), size
+
+
+def normalize_source(code):
+    """
+    规范化源码用于判断是否为相同提交：统一换行符，去掉行尾空白和首尾空行
+    """
+    lines = code.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    return '\n'.join(line.rstrip() for line in lines).strip('\n')
+
+
+def strip_timing(result):
+    """去掉判题结果及各测试点中的阶段耗时"""
+    if not isinstance(result, dict):
+        return result
+    result = {k: v for k, v in result.items() if k != 'timing'}
+    if isinstance(result.get('details'), list):
+        result['details'] = [{k: v for k, v in d.items() if k != 'timing'} for d in result['details']]
+    return result
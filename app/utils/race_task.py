@@ -1,7 +1,11 @@
 from celery.schedules import crontab
 from app.extensions import celery
 from .. import create_app
-from ..services.race_service import update_race_status, race_reminder
+from .judge_task import warmup_judge_nodes
+from ..models import QuestionsData, RaceData
+from ..services.question_service import cache_judge_question
+from ..services.race_service import update_race_status, race_reminder, prime_race_question_stats, \
+    get_race_problem_ids
 
 
 @celery.on_after_configure.connect
@@ -22,11 +26,44 @@ def setup_periodic_tasks(sender, **kwargs):
 
 @celery.task
 def check_race_status():
-    try:
-        update_race_status()
-        return {'success': True, 'message': '比赛状态已更新'}
-    except Exception as e:
-        return {'success': False, 'message': str(e)}
+    app = create_app()
+    with app.app_context():
+        try:
+            started = update_race_status()
+            # 刚开始的比赛立即预热，避免开赛第一分钟集中冷启动
+            for race_id in started:
+                warmup_race_task.delay(race_id)
+            return {'success': True, 'message': '比赛状态已更新', 'started': started}
+        except Exception as e:
+            return {'success': False, 'message': str(e)}
+
+
+@celery.task
+def warmup_race_task(race_id):
+    """
+    比赛开始预热：缓存比赛题目的判题信息，预先创建各题的全局统计记录，
+    并通知每个判题节点把测试用例清单和测试数据读入内存
+    """
+    app = create_app()
+    with app.app_context():
+        try:
+            race = RaceData.query.get(race_id)
+            if not race:
+                return {'success': False, 'message': f'比赛不存在: {race_id}'}
+
+            problems_list = get_race_problem_ids(race)
+            for question in QuestionsData.query.filter(QuestionsData.uid.in_(problems_list)).all():
+                cache_judge_question(question)
+
+            new_stats = prime_race_question_stats(race_id)
+            nodes = warmup_judge_nodes(problems_list)
+
+            app.logger.info(f"比赛 {race_id} 预热完成: {len(problems_list)} 道题, 新建全局统计记录 {new_stats} 条, "
+                            f"通知判题节点 {nodes} 个")
+            return {'success': True, 'message': '比赛预热完成', 'problems': problems_list}
+        except Exception as e:
+            app.logger.error(f"比赛预热失败: {str(e)}", exc_info=True)
+            return {'success': False, 'message': str(e)}
 
 
 @celery.task
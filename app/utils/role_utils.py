@@ -32,7 +32,7 @@ def optional_login(f):
     """
         可选登录装饰器。
         用于在 Flask 视图函数中检查用户的登录状态（通过 Cookie 中的 auth_token）。
-        如果用户已登录（即 auth_token 有效），则将用户 ID 存储在 g.current_user_id 中；
+        如果用户已登录（即 auth_token 有效），则将用户 ID 存储在 g.current_user_id 中，角色存储在 g.current_user_role 中；
         如果用户未登录或 Token 无效，则保持游客状态，不影响正常访问。
         """
 
@@ -41,6 +41,7 @@ def optional_login(f):
         # 清除可能存在的旧用户ID
         if hasattr(g, 'current_user_id'):
             del g.current_user_id
+        g.current_user_role = None
 
         # 统一使用get()方法读取Cookie
         token = request.cookies.get('auth_token')
@@ -48,6 +49,7 @@ def optional_login(f):
             try:
                 data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
                 g.current_user_id = data['uid']  # 确保使用小写uid
+                g.current_user_role = data.get('role')
             except jwt.PyJWTError:
                 pass  # 保持游客状态
         return f(*args, **kwargs)
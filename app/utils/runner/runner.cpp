@@ -0,0 +1,240 @@
+/*
+ * 判题运行器：由它 fork 并运行选手程序，回收后把内核记录的资源使用写入统计管道。
+ * 选手程序从这个很小的进程 fork 出来，峰值内存才不会算上判题 Python 进程本身的内存。
+ *
+ * 资源限制在 exec 之前由内核设置，超限的程序会被直接结束，而不是运行结束后才判定：
+ *   CPU 时间超过限制时收到 SIGXCPU（再超过 1 秒收到 SIGKILL），
+ *   地址空间超过限制时内存分配失败。
+ *
+ * 运行器收到 SIGTERM 时结束选手程序，并照常输出资源使用统计（判题提前结束程序时使用）。
+ *
+ * 用法: runner <统计管道fd> <CPU时间限制秒> <地址空间限制字节> <程序> [参数...]
+ *       限制为 0 表示不限制
+ * 输出: <wait 状态> <峰值内存KB> <用户态CPU微秒> <内核态CPU微秒>
+ *
+ * 常驻模式: runner --serve <套接字fd>
+ *   判题进程预先启动一组常驻运行器，通过 Unix 套接字（SOCK_SEQPACKET）逐条发送命令，
+ *   每条命令附带选手程序的 stdin/stdout/stderr 三个描述符（SCM_RIGHTS）：
+ *     <CPU时间限制秒> <地址空间限制字节> <墙钟时间限制毫秒> <程序路径>
+ *   fork 之后回复 "pid <进程号>"（选手程序是新会话的首进程，可按进程组结束），
+ *   回收之后回复 "done <wait 状态> <峰值内存KB> <用户态CPU微秒> <内核态CPU微秒> <是否超出墙钟时间>"。
+ *   墙钟时间超限时由运行器结束整个进程组；回收首进程后，进程组中残留的进程（选手程序 fork 出的子进程，
+ *   可能仍持有 stdout）也一并结束；套接字关闭（判题进程退出）时运行器退出。
+ */
+#include <cerrno>
+#include <cstdio>
+#include <cstdlib>
+#include <csignal>
+#include <cstring>
+#include <fcntl.h>
+#include <sys/resource.h>
+#include <sys/socket.h>
+#include <sys/time.h>
+#include <sys/wait.h>
+#include <unistd.h>
+
+static volatile pid_t child_pid = 0;
+static volatile sig_atomic_t wall_timed_out = 0;
+
+static void on_terminate(int) {
+    if (child_pid > 0) {
+        kill(child_pid, SIGKILL);
+    }
+}
+
+static void on_wall_timeout(int) {
+    if (child_pid > 0) {
+        wall_timed_out = 1;
+        kill(-child_pid, SIGKILL);
+    }
+}
+
+// 在子进程中设置资源限制并执行选手程序，不返回
+static void exec_program(rlim_t cpu_seconds, rlim_t address_space, char *argv[]) {
+    if (cpu_seconds > 0) {
+        struct rlimit limit = {cpu_seconds, cpu_seconds + 1};
+        setrlimit(RLIMIT_CPU, &limit);
+    }
+    if (address_space > 0) {
+        struct rlimit limit = {address_space, address_space};
+        setrlimit(RLIMIT_AS, &limit);
+        // 栈与内存限制一致，避免深递归在默认 8MB 栈上提前崩溃
+        setrlimit(RLIMIT_STACK, &limit);
+    }
+    execv(argv[0], argv);
+    perror("execv");
+    _exit(127);
+}
+
+static int wait_child(pid_t pid, int *status, struct rusage *usage) {
+    while (wait4(pid, status, 0, usage) < 0) {
+        if (errno != EINTR) {
+            perror("wait4");
+            return -1;
+        }
+    }
+    return 0;
+}
+
+static long usec(const struct timeval &tv) {
+    return tv.tv_sec * 1000000L + tv.tv_usec;
+}
+
+static void reply(int sock, const char *message) {
+    send(sock, message, strlen(message), MSG_NOSIGNAL);
+}
+
+static int serve(int sock) {
+    fcntl(sock, F_SETFD, FD_CLOEXEC);
+
+    // 墙钟计时器到期时中断 wait4（不自动重启系统调用）
+    struct sigaction action = {};
+    action.sa_handler = on_wall_timeout;
+    sigaction(SIGALRM, &action, NULL);
+    sigset_t alarm_set;
+    sigemptyset(&alarm_set);
+    sigaddset(&alarm_set, SIGALRM);
+
+    for (;;) {
+        char buffer[4096];
+        char control[CMSG_SPACE(3 * sizeof(int))];
+        struct iovec iov = {buffer, sizeof(buffer) - 1};
+        struct msghdr message = {};
+        message.msg_iov = &iov;
+        message.msg_iovlen = 1;
+        message.msg_control = control;
+        message.msg_controllen = sizeof(control);
+
+        ssize_t length = recvmsg(sock, &message, MSG_CMSG_CLOEXEC);
+        if (length < 0) {
+            if (errno == EINTR) {
+                continue;
+            }
+            return 2;
+        }
+        if (length == 0) {
+            return 0;
+        }
+        buffer[length] = '\0';
+
+        int fds[3];
+        int fd_count = 0;
+        for (struct cmsghdr *cmsg = CMSG_FIRSTHDR(&message); cmsg; cmsg = CMSG_NXTHDR(&message, cmsg)) {
+            if (cmsg->cmsg_level == SOL_SOCKET && cmsg->cmsg_type == SCM_RIGHTS) {
+                fd_count = (cmsg->cmsg_len - CMSG_LEN(0)) / sizeof(int);
+                memcpy(fds, CMSG_DATA(cmsg), sizeof(int) * (fd_count < 3 ? fd_count : 3));
+            }
+        }
+
+        unsigned long long cpu_seconds, address_space, wall_ms;
+        int offset = 0;
+        bool valid = fd_count == 3 &&
+                     sscanf(buffer, "%llu %llu %llu %n", &cpu_seconds, &address_space, &wall_ms, &offset) == 3 &&
+                     buffer[offset] != '\0';
+        if (!valid) {
+            for (int i = 0; i < fd_count && i < 3; i++) {
+                close(fds[i]);
+            }
+            reply(sock, "error invalid command\n");
+            continue;
+        }
+        char *path = buffer + offset;
+        path[strcspn(path, "\n")] = '\0';
+
+        wall_timed_out = 0;
+        pid_t pid = fork();
+        if (pid == 0) {
+            setsid();
+            dup2(fds[0], STDIN_FILENO);
+            dup2(fds[1], STDOUT_FILENO);
+            dup2(fds[2], STDERR_FILENO);
+            sigprocmask(SIG_UNBLOCK, &alarm_set, NULL);
+            signal(SIGALRM, SIG_DFL);
+            char *argv[] = {path, NULL};
+            exec_program(cpu_seconds, address_space, argv);
+        }
+        for (int i = 0; i < 3; i++) {
+            close(fds[i]);
+        }
+        if (pid < 0) {
+            reply(sock, "error fork failed\n");
+            continue;
+        }
+
+        child_pid = pid;
+        char line[128];
+        snprintf(line, sizeof(line), "pid %d\n", pid);
+        reply(sock, line);
+
+        if (wall_ms > 0) {
+            struct itimerval timer = {};
+            timer.it_value.tv_sec = wall_ms / 1000;
+            timer.it_value.tv_usec = (wall_ms % 1000) * 1000;
+            setitimer(ITIMER_REAL, &timer, NULL);
+        }
+
+        int status;
+        struct rusage usage;
+        int waited = wait_child(pid, &status, &usage);
+        // 首进程结束后，它 fork 出的进程仍在同一进程组中，可能继续持有 stdout 或占用 CPU
+        kill(-pid, SIGKILL);
+
+        // 回收后立即停止计时器，避免向已结束的进程组发送信号
+        sigprocmask(SIG_BLOCK, &alarm_set, NULL);
+        struct itimerval stop = {};
+        setitimer(ITIMER_REAL, &stop, NULL);
+        child_pid = 0;
+        sigprocmask(SIG_UNBLOCK, &alarm_set, NULL);
+
+        if (waited < 0) {
+            reply(sock, "error wait failed\n");
+            return 2;
+        }
+        snprintf(line, sizeof(line), "done %d %ld %ld %ld %d\n", status, (long) usage.ru_maxrss,
+                 usec(usage.ru_utime), usec(usage.ru_stime), (int) wall_timed_out);
+        reply(sock, line);
+    }
+}
+
+int main(int argc, char *argv[]) {
+    if (argc == 3 && strcmp(argv[1], "--serve") == 0) {
+        return serve(atoi(argv[2]));
+    }
+    if (argc < 5) {
+        fprintf(stderr, "usage: runner <stat_fd> <cpu_seconds> <address_space_bytes> <program> [args...]\n");
+        return 2;
+    }
+    int stat_fd = atoi(argv[1]);
+    rlim_t cpu_seconds = strtoull(argv[2], NULL, 10);
+    rlim_t address_space = strtoull(argv[3], NULL, 10);
+
+    struct sigaction action = {};
+    action.sa_handler = on_terminate;
+    sigaction(SIGTERM, &action, NULL);
+
+    pid_t pid = fork();
+    if (pid < 0) {
+        perror("fork");
+        return 2;
+    }
+    if (pid == 0) {
+        close(stat_fd);
+        exec_program(cpu_seconds, address_space, argv + 4);
+    }
+    child_pid = pid;
+
+    int status;
+    struct rusage usage;
+    if (wait_child(pid, &status, &usage) < 0) {
+        return 2;
+    }
+
+    dprintf(stat_fd, "%d %ld %ld %ld\n", status, (long) usage.ru_maxrss,
+            usec(usage.ru_utime), usec(usage.ru_stime));
+    close(stat_fd);
+
+    if (WIFEXITED(status)) {
+        return WEXITSTATUS(status);
+    }
+    return 128 + WTERMSIG(status);
+}
@@ -0,0 +1,312 @@
+"""
+判题性能基准测试
+
+生成若干合成题目（小/大输入输出、测试点多/少、TLE/MLE/WA 程序），在本机直接调用 _judge_cpp，
+或经判题队列提交，统计吞吐量（每秒提交数）、延迟 p50/p99、编译与运行耗时以及判题机的峰值内存
+（直接调用时为本进程及其子进程，经判题队列时为各判题 worker 上报的常驻内存之和）。
+每次修改判题代码、比赛开始前都应在判题机上运行一次并对比结果。
+
+用法:
+    python -m benchmark.judge_benchmark
+    python -m benchmark.judge_benchmark --scenarios small_io,large_io --submissions 50 --concurrency 4
+    python -m benchmark.judge_benchmark --cold-compile          # 每次提交的源码都不同，强制真实编译
+    python -m benchmark.judge_benchmark --queued --problem-id 1 --user-id 1
+        # 经 judge 队列提交（需要 Redis、数据库和判题 worker，会写入真实的提交记录）
+"""
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import psutil
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.judge_service import _judge_cpp  # noqa: E402
+from app.services.testcase_service import write_manifest  # noqa: E402
+
+PROGRAMS = {
+    # 读入 n 个数输出总和
+    'sum': r'''#include <bits/stdc++.h>
+int main(){int n;if(scanf("%d",&n)!=1)return 0;long long s=0;
+for(int i=0;i<n;i++){long long x;scanf("%lld",&x);s+=x;}printf("%lld\n",s);}''',
+    # 原样逐行输出 n 个数（大输出）
+    'echo': r'''#include <bits/stdc++.h>
+int main(){int n;if(scanf("%d",&n)!=1)return 0;
+for(int i=0;i<n;i++){long long x;scanf("%lld",&x);printf("%lld\n",x);}}''',
+    # 总和多 1（第一个测试点即答案错误）
+    'wrong': r'''#include <bits/stdc++.h>
+int main(){int n;if(scanf("%d",&n)!=1)return 0;long long s=1;
+for(int i=0;i<n;i++){long long x;scanf("%lld",&x);s+=x;}printf("%lld\n",s);}''',
+    # 死循环（超时）
+    'loop': r'''int main(){volatile unsigned long long x=0;for(;;)x++;}''',
+    # 申请并写满 256MB（超内存）
+    'alloc': r'''#include <bits/stdc++.h>
+int main(){std::vector<char> v(256<<20);for(size_t i=0;i<v.size();i+=4096)v[i]=1;printf("%d\n",v[4096]);}''',
+}
+
+# 场景：测试点数、每个测试点的数字个数、选手程序、时间限制（毫秒）、内存限制（MB）
+SCENARIOS = {
+    'small_io': {'cases': 5, 'numbers': 10, 'program': 'sum', 'time_limit': 1000, 'memory_limit': 256},
+    'many_cases': {'cases': 50, 'numbers': 10, 'program': 'sum', 'time_limit': 1000, 'memory_limit': 256},
+    'large_io': {'cases': 3, 'numbers': 500000, 'program': 'sum', 'time_limit': 2000, 'memory_limit': 256},
+    'large_output': {'cases': 3, 'numbers': 200000, 'program': 'echo', 'time_limit': 2000, 'memory_limit': 256},
+    'wa': {'cases': 10, 'numbers': 10, 'program': 'wrong', 'time_limit': 1000, 'memory_limit': 256},
+    'tle': {'cases': 2, 'numbers': 10, 'program': 'loop', 'time_limit': 500, 'memory_limit': 256},
+    'mle': {'cases': 2, 'numbers': 10, 'program': 'alloc', 'time_limit': 1000, 'memory_limit': 64},
+}
+
+DEFAULT_SCENARIOS = ['small_io', 'many_cases', 'large_io', 'large_output', 'wa', 'tle', 'mle']
+
+
+def generate_problem(root, name, scenario, seed=0):
+    """生成一道合成题目的测试数据和清单，返回测试用例目录"""
+    rng = random.Random(seed)
+    testcase_dir = os.path.join(root, f"testcases_{name}")
+    for index in range(1, scenario['cases'] + 1):
+        case_dir = os.path.join(testcase_dir, str(index))
+        os.makedirs(case_dir, exist_ok=True)
+        numbers = [rng.randint(1, 10 ** 9) for _ in range(scenario['numbers'])]
+        with open(os.path.join(case_dir, f"{index}.in"), 'w') as f:
+            f.write(f"{len(numbers)}\n{' '.join(map(str, numbers))}\n")
+        with open(os.path.join(case_dir, f"{index}.out"), 'w') as f:
+            if scenario['program'] == 'echo':
+                f.write('\n'.join(map(str, numbers)) + '\n')
+            else:
+                f.write(f"{sum(numbers)}\n")
+    write_manifest(testcase_dir)
+    return testcase_dir
+
+
+class MemorySampler:
+    """后台采样本进程及其全部子进程（编译器、运行器、选手程序）的内存占用之和，记录峰值"""
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peak_rss = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        process = psutil.Process()
+        total = 0
+        for p in [process] + process.children(recursive=True):
+            try:
+                total += p.memory_info().rss
+            except psutil.Error:
+                continue
+        self.peak_rss = max(self.peak_rss, total)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._sample()
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+class WorkerMemorySampler:
+    """
+    --queued 模式：定期读取各判题 worker 上报的常驻内存（worker 进程及其子进程，每次判题结束时上报），
+    记录运行期间全部 worker 之和的峰值
+    """
+
+    def __init__(self, app, interval=0.5):
+        self.app = app
+        self.interval = interval
+        self.peak_rss = 0
+        self._start = int(time.time())
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        from app.services.judge_metrics_service import get_judge_metrics
+
+        with self.app.app_context():
+            workers = get_judge_metrics()['workers']
+        # 只统计本次运行期间上报过的 worker
+        total = sum(w.get('rss', 0) for w in workers if w['updated_at'] >= self._start)
+        self.peak_rss = max(self.peak_rss, total)
+
+    def _run(self):
+        # 停止后再采样一次，包含最后几个提交判完时上报的内存
+        while True:
+            stopped = self._stop.is_set()
+            try:
+                self._sample()
+            except Exception:
+                pass  # Redis 暂时不可用时等待下一次采样
+            if stopped:
+                return
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def percentile(values, p):
+    """第 p 百分位数"""
+    if not values:
+        return 0.0
+    # 最近秩法
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def _source(program, cold_compile):
+    code = PROGRAMS[program]
+    # 追加唯一注释使源码哈希不同，绕过编译缓存
+    return code + f"\n// {uuid.uuid4().hex}\n" if cold_compile else code
+
+
+def run_direct(testcase_dir, scenario, submissions, concurrency, cold_compile):
+    """直接调用 _judge_cpp，编译和运行耗时取自判题结果的 timing"""
+
+    def submit(_):
+        code = _source(scenario['program'], cold_compile)
+        start = time.perf_counter()
+        result = _judge_cpp(code, testcase_dir, scenario['time_limit'], scenario['memory_limit'] * 1024 * 1024)
+        return {
+            'status': result['status'],
+            'latency': (time.perf_counter() - start) * 1000,
+            'compile': result['timing']['compile_ms'],
+            'run': result['timing']['run_ms']
+        }
+
+    # 预热：编译运行器、预编译头，并让非冷编译模式命中编译缓存
+    submit(None)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(submit, range(submissions)))
+
+
+def run_queued(app, problem_id, user_id, program, submissions, concurrency, cold_compile, timeout):
+    """
+    经判题队列提交，延迟包含排队时间（需要 Redis、数据库和判题 worker）
+    不加 --cold-compile 时，第一次之后的提交会直接命中相同提交的判题结果缓存
+    """
+    from app.utils.judge_task import enqueue_judge_submission
+
+    def submit(_):
+        code = _source(program, cold_compile)
+        start = time.perf_counter()
+        with app.app_context():
+            async_result = enqueue_judge_submission(user_id, problem_id, code, 'cpp')
+        result = async_result.get(timeout=timeout)
+        timing = result.get('timing') or {}
+        return {
+            'status': result.get('status'),
+            'latency': (time.perf_counter() - start) * 1000,
+            'compile': timing.get('compile_ms', 0.0),
+            'run': timing.get('run_ms', 0.0)
+        }
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(submit, range(submissions)))
+
+
+def summarize(name, samples, elapsed, peak_rss):
+    latencies = [s['latency'] for s in samples]
+    statuses = {}
+    for s in samples:
+        statuses[s['status']] = statuses.get(s['status'], 0) + 1
+    return {
+        'scenario': name,
+        'submissions': len(samples),
+        'throughput': len(samples) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 50),
+        'p99_ms': percentile(latencies, 99),
+        'compile_ms': sum(s['compile'] for s in samples) / len(samples) if samples else 0.0,
+        'run_ms': sum(s['run'] for s in samples) / len(samples) if samples else 0.0,
+        'peak_rss_mb': peak_rss / (1024 * 1024),
+        'statuses': statuses
+    }
+
+
+def print_report(rows):
+    header = f"{'场景':<14}{'提交数':>8}{'提交/秒':>10}{'p50(ms)':>10}{'p99(ms)':>10}" \
+             f"{'编译(ms)':>10}{'运行(ms)':>10}{'峰值内存(MB)':>14}  结果"
+    print(header)
+    for r in rows:
+        statuses = ', '.join(f"{k}×{v}" for k, v in r['statuses'].items())
+        print(f"{r['scenario']:<14}{r['submissions']:>8}{r['throughput']:>10.2f}{r['p50_ms']:>10.1f}"
+              f"{r['p99_ms']:>10.1f}{r['compile_ms']:>10.1f}{r['run_ms']:>10.1f}{r['peak_rss_mb']:>14.1f}  {statuses}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='判题性能基准测试')
+    parser.add_argument('--scenarios', default=','.join(DEFAULT_SCENARIOS),
+                        help=f"逗号分隔的场景，可选: {', '.join(SCENARIOS)}")
+    parser.add_argument('--submissions', type=int, default=20, help='每个场景的提交数')
+    parser.add_argument('--concurrency', type=int, default=os.cpu_count() or 1, help='同时进行的提交数')
+    parser.add_argument('--cold-compile', action='store_true', help='每次提交的源码都不同，强制真实编译')
+    parser.add_argument('--seed', type=int, default=0, help='生成测试数据的随机种子')
+    parser.add_argument('--json', dest='json_path', help='同时把结果写入 JSON 文件')
+    parser.add_argument('--queued', action='store_true', help='经判题队列提交（使用已有题目，不生成合成题目）')
+    parser.add_argument('--problem-id', type=int, help='--queued 模式下提交的题目ID')
+    parser.add_argument('--user-id', type=int, help='--queued 模式下的提交用户ID')
+    parser.add_argument('--program', default='sum', choices=list(PROGRAMS), help='--queued 模式下提交的程序')
+    parser.add_argument('--timeout', type=int, default=300, help='--queued 模式下单个提交的等待上限，秒')
+    args = parser.parse_args(argv)
+
+    rows = []
+    if args.queued:
+        if not args.problem_id or not args.user_id:
+            parser.error('--queued 需要 --problem-id 和 --user-id')
+        from app import create_app
+
+        # 入队时计算优先级需要 Redis（redis_wrapper 在创建应用时初始化）
+        app = create_app()
+        # 判题在 worker 上进行，峰值内存取各判题 worker 上报的常驻内存，而不是本进程
+        with WorkerMemorySampler(app) as sampler:
+            start = time.perf_counter()
+            samples = run_queued(app, args.problem_id, args.user_id, args.program, args.submissions,
+                                 args.concurrency, args.cold_compile, args.timeout)
+            elapsed = time.perf_counter() - start
+        rows.append(summarize(f"queued_{args.problem_id}", samples, elapsed, sampler.peak_rss))
+    else:
+        root = tempfile.mkdtemp(prefix='judge_benchmark_')
+        try:
+            for name in args.scenarios.split(','):
+                name = name.strip()
+                if name not in SCENARIOS:
+                    parser.error(f"未知场景: {name}")
+                scenario = SCENARIOS[name]
+                testcase_dir = generate_problem(root, name, scenario, args.seed)
+                with MemorySampler() as sampler:
+                    start = time.perf_counter()
+                    samples = run_direct(testcase_dir, scenario, args.submissions, args.concurrency,
+                                         args.cold_compile)
+                    elapsed = time.perf_counter() - start
+                rows.append(summarize(name, samples, elapsed, sampler.peak_rss))
+                print(f"{name}: {len(samples)} 个提交, {elapsed:.2f} 秒", flush=True)
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+    print()
+    print_report(rows)
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump({'args': vars(args), 'results': rows}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
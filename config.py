@@ -17,7 +17,8 @@ class Config:
     JWT_EXPIRATION = timedelta(hours=4)  # Token有效期
 
     # 数据库配置
-    SQLALCHEMY_DATABASE_URI = 'mysql+pymysql://root:@localhost:3308/reborn_oj_master'
+    # 多台判题节点共用同一个数据库和 Redis，地址可通过环境变量指定
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'mysql+pymysql://root:@localhost:3308/reborn_oj_master'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
     # 会话配置
@@ -50,9 +51,9 @@ class Config:
         "password": os.environ.get('SMTP_PASSWORD')
     }
     REDIS_CONFIG = {
-        "host": "localhost",
-        "port": 6379,
-        "db": 0
+        "host": os.environ.get('REDIS_HOST', 'localhost'),
+        "port": int(os.environ.get('REDIS_PORT', 6379)),
+        "db": int(os.environ.get('REDIS_DB', 0))
     }
 
     # deepseek api
@@ -72,9 +73,55 @@ class Config:
     LOG_FORMAT = '[%(asctime)s] %(levelname)s in %(module)s: %(message)s'
 
     # Celery 配置
-    broker_url = 'redis://localhost:6379/0'
-    result_backend = 'redis://localhost:6379/1'
+    broker_url = os.environ.get('CELERY_BROKER_URL') or f"redis://{REDIS_CONFIG['host']}:{REDIS_CONFIG['port']}/0"
+    result_backend = os.environ.get('CELERY_RESULT_BACKEND') or f"redis://{REDIS_CONFIG['host']}:{REDIS_CONFIG['port']}/1"
     beat_schedule_dir = os.path.join(os.path.dirname(__file__), 'data', 'celery')
 
     # 测试用例配置
     TESTCASE_DIR = os.path.join(os.path.dirname(__file__), 'data', 'test_case', 'problems')
+
+    # 判题队列配置
+    JUDGE_QUEUE = 'judge'
+    # 判题队列优先级通道的起始优先级（0 最高）：进行中的比赛 > 练习 > 重测
+    JUDGE_PRIORITY_LANES = {'contest': 0, 'practice': 3, 'rejudge': 6}
+    JUDGE_FAIRNESS_STEPS = 3  # 同一通道内按用户尚未判完的提交数降低优先级的级数
+    JUDGE_PENDING_TTL = 60 * 60  # 用户待判提交数的过期时间，秒
+    # 准入控制：过载时快速拒绝新提交（429/503 + Retry-After），而不是让所有提交一起变慢
+    JUDGE_USER_RATE = 0.2  # 每个用户的提交令牌每秒补充数（平均每 5 秒一次），0 表示不限制
+    JUDGE_USER_BURST = 5  # 每个用户最多连续提交的次数（令牌桶容量）
+    JUDGE_MAX_QUEUE_LENGTH = {'contest': 2000, 'practice': 500}  # 各通道前方待判任务数上限，重测不限制
+    JUDGE_RETRY_AFTER = 10  # 判题队列已满时建议客户端重试的等待时间，秒
+    JUDGE_REJUDGE_TTL = 24 * 60 * 60  # 重测任务进度的保留时间，秒
+    JUDGE_SUBMISSION_TTL = 24 * 60 * 60  # 提交记录（用于查询判题状态）保留时间，秒
+    JUDGE_PARALLEL_CASES = True  # 是否并发运行同一提交的测试点
+    JUDGE_MAX_WORKERS = os.cpu_count() or 1  # 并发运行测试点的线程数上限
+    JUDGE_MAX_CONCURRENT_JUDGES = JUDGE_MAX_WORKERS  # 每个判题进程同时编译运行的提交数上限，其余提交在进程内等待
+    JUDGE_WALL_TIME_FACTOR = 2  # 墙钟时间上限为时间限制的倍数（超时按 CPU 时间判定）
+    JUDGE_TIME_GRACE_MS = 500  # 看门狗在墙钟时间上限之外额外等待的毫秒数
+    JUDGE_OUTPUT_LIMIT = 64 * 1024 * 1024  # 选手程序输出上限（字节），超过判为 Output Limit Exceeded
+    JUDGE_ADDRESS_SPACE_MARGIN = 64 * 1024 * 1024  # 地址空间限制 = 内存限制 + 余量（运行库映射等）
+    JUDGE_CHECKER_TIMEOUT = 10  # 特殊判题程序（checker）运行时间上限，秒
+
+    # 编译缓存配置
+    COMPILE_CACHE_DIR = os.path.join(os.path.dirname(__file__), 'data', 'judge', 'compile_cache')
+    COMPILE_CACHE_MAX_BYTES = 512 * 1024 * 1024  # 512MB
+    JUDGE_USE_PCH = True  # 是否使用 bits/stdc++.h 预编译头加速编译
+    PCH_DIR = os.path.join(os.path.dirname(__file__), 'data', 'judge', 'pch')
+    RUNNER_DIR = os.path.join(os.path.dirname(__file__), 'data', 'judge', 'runner')
+    JUDGE_RUNNER_POOL = True  # 是否使用常驻运行器池（每个核一个运行器进程，仅 Linux）
+
+    # 测试数据内存缓存配置（每个判题 worker 进程独立）
+    JUDGE_TESTCASE_CACHE_MAX_BYTES = 256 * 1024 * 1024  # 缓存容量上限，按最近最少使用淘汰
+    JUDGE_TESTCASE_CACHE_MAX_ENTRY_BYTES = 16 * 1024 * 1024  # 超过该大小的文件不缓存
+    JUDGE_STDIN_PIPE_MAX_BYTES = 1024 * 1024  # 不超过该大小的输入从内存写入管道作为 stdin，否则直接使用文件
+    JUDGE_METRICS_TTL = 10 * 60  # 判题 worker 上报的指标保留时间，秒
+    JUDGE_TIMING_SAMPLES = 256  # 每个判题阶段保留的最近耗时样本数，用于计算 p50/p99
+    JUDGE_QUESTION_CACHE_TTL = 60 * 60  # 判题所需题目信息（时间、内存限制）在 Redis 中的缓存时间，秒
+    JUDGE_VERDICT_CACHE_TTL = 10 * 60  # 相同提交（题目、测试数据版本、语言、源码均相同）直接复用判题结果的时间窗口，秒
+
+    # 多节点判题配置
+    JUDGE_NODE_HEARTBEAT_INTERVAL = 10  # 判题节点上报心跳（容量、负载）的间隔，秒
+    JUDGE_NODE_TTL = 30  # 超过该时间没有心跳的判题节点视为离线，秒
+    JUDGE_TESTDATA_STALE_TTL = 60 * 60  # 重新上传后旧版本测试数据在 Redis 中的保留时间（供正在拉取的节点使用），秒
+    JUDGE_TESTDATA_TTL = 7 * 24 * 60 * 60  # 当前版本测试数据压缩包在 Redis 中的保留时间，判题节点使用时续期，过期后由持有该版本的节点重新发布，秒
+    JUDGE_TESTDATA_REFRESH_INTERVAL = 10 * 60  # 判题进程为测试数据压缩包续期、清理本机旧版本快照的间隔，秒
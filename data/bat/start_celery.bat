@@ -1,3 +1,4 @@
 @echo off
 start cmd /k "cd ..\.. && celery -A app.extensions.celery worker --pool=solo --loglevel=info"
+start cmd /k "cd ..\.. && celery -A app.extensions.celery worker -Q judge --pool=threads --concurrency=4 --loglevel=info"
 start cmd /k "cd ..\.. && celery -A app.extensions.celery beat --loglevel=info"
\ No newline at end of file